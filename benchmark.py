@@ -0,0 +1,154 @@
+# This file times the hot paths of the program on a generated ledger and compares them to a saved baseline
+
+# importing libraries
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+import chart_data
+import data_visuals
+import functions
+import generate_ledger
+import main
+import rollup
+import storage
+
+DATE_FORMAT = '%m-%d-%Y'
+RUNS = 5
+# a benchmark counts as a regression when its median is this much slower than the baseline
+REGRESSION_THRESHOLD = 0.10
+
+# returns a stand-in for pyplot and seaborn, so only the work draw_* does on its table is timed
+def plotting_stub():
+    stub = mock.MagicMock()
+    stub.subplots.return_value = (mock.MagicMock(), mock.MagicMock())
+    return stub
+
+# runs a function a number of times and returns its timings in seconds
+def time_runs(function, runs=RUNS, setup=None):
+    timings = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'median': statistics.median(timings), 'min': min(timings), 'runs': runs}
+
+# returns every benchmark as name -> (function, setup run before each timing)
+def build_benchmarks(csv_file, start_date, end_date):
+    clear_cache = storage._session_cache.clear
+    df = main.CSV.load_transactions()
+    monthly = chart_data.load_monthly_totals(csv_file, DATE_FORMAT)
+    period = chart_data.latest_period(monthly)
+    daily_rows = chart_data.load_daily_rows(csv_file, DATE_FORMAT, period - 1, period)
+    tables = {chart: table for chart, (table, months) in chart_data.tables_for_period(monthly, period, daily_rows).items()}
+    filters = {
+        "Start Date": pd.Timestamp(start_date), "End Date": pd.Timestamp(end_date),
+        "Category": ['Essential', 'Non-Essential'], "Sub-Category": [],
+        "Lower Amount": 10, "Upper Amount": 500,
+    }
+
+    # get_summary asks whether to show the rows and prints the totals
+    def get_summary():
+        with mock.patch('builtins.input', return_value='n'), contextlib.redirect_stdout(io.StringIO()):
+            main.CSV.get_summary(start_date, end_date)
+
+    def add_entry():
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.CSV.add_entry(end_date, 'Non-Essential', 'Other', 'benchmark', 1.0)
+
+    return {
+        'initialize_csv': (main.CSV.initialize_csv, None),
+        'add_entry': (add_entry, None),
+        'load_ledger_cold': (lambda: storage.load_ledger(csv_file), clear_cache),
+        'load_ledger_warm': (lambda: storage.load_ledger(csv_file), None),
+        'get_summary_cold': (get_summary, clear_cache),
+        'get_summary_warm': (get_summary, None),
+        'rollup_rebuild': (lambda: rollup.build_rollup(csv_file), None),
+        'filter_transaction_dataframe': (lambda: functions.filter_transaction_dataframe(df, filters), None),
+        'memo_keyword_scan': (lambda: functions.filter_transaction_dataframe(df, {'Keywords': 'cash'}), None),
+        'memo_keyword_index': (lambda: functions.filter_transaction_dataframe(df, {'Keywords': 'cash'}, csv_file), None),
+        'get_table_totals': (lambda: functions.get_table_totals(df), None),
+        'chart_data_compute': (lambda: chart_data.compute(csv_file, DATE_FORMAT), None),
+        'chart_tables': (lambda: chart_data.tables_for_period(monthly, period, daily_rows), None),
+        'draw_cash_flow': (lambda: data_visuals.draw_cash_flow(tables['cash_flow'], show=False), None),
+        'draw_categorical_expenses': (lambda: data_visuals.draw_categorical_expenses(tables['categorical_expenses'], show=False), None),
+        'draw_subcat_expenses': (lambda: data_visuals.draw_subcat_expenses(tables['subcat_expenses'], show=False), None),
+        'draw_cumsum_plot': (lambda: data_visuals.draw_cumsum_plot(tables['monthly_spending'], show=False), None),
+    }
+
+# generates a ledger in a temporary directory and times every benchmark on it
+def run(rows, runs=RUNS, only=None):
+    tmp_dir = tempfile.mkdtemp()
+    csv_file = os.path.join(tmp_dir, 'transactions.csv')
+    end = pd.Timestamp.today().normalize()
+    generate_ledger.write_ledger(csv_file, rows, end_date=end)
+    start_date = (end - pd.DateOffset(months=3)).strftime(DATE_FORMAT)
+    end_date = end.strftime(DATE_FORMAT)
+
+    try:
+        with mock.patch.object(main.CSV, 'CSV_file', csv_file), \
+             mock.patch.object(data_visuals, 'plt', plotting_stub()), \
+             mock.patch.object(data_visuals, 'sns', plotting_stub()):
+            # the generated single-file ledger is partitioned first, like the menu does on start
+            main.CSV.initialize_csv()
+            results = {}
+            for name, (function, setup) in build_benchmarks(csv_file, start_date, end_date).items():
+                if only and name not in only:
+                    continue
+                results[name] = time_runs(function, runs, setup)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    meta = {'rows': rows, 'runs': runs, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'machine': platform.machine(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+# returns the benchmarks that got slower than the baseline by more than the threshold
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    regressions = {}
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['median'] / baseline['results'][name]['median']
+        print(f"{name:<40} {baseline['results'][name]['median'] * 1000:>10.2f} ms -> "
+              f"{result['median'] * 1000:>10.2f} ms  ({ratio:.2f}x)")
+        if ratio > 1 + threshold:
+            regressions[name] = ratio
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths on a generated ledger')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--runs', type=int, default=RUNS)
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--out', default='bench_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.runs, args.only)
+    with open(args.out, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"\nSlower than the baseline: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for name, result in results['results'].items():
+            print(f"{name:<40} {result['median'] * 1000:>10.2f} ms")
@@ -0,0 +1,182 @@
+# This file keeps month-to-date spending per category and sub-category and warns when a budget limit is near
+# limits are set in <ledger>_budgets.json, e.g. {"limits": {"Groceries": 400, "Essential": 1500}, "thresholds": [80, 100]}
+
+# importing libraries
+# pandas and storage are only imported for a full recompute, so checking a budget on every add stays cheap
+import argparse
+import json
+import os
+from datetime import datetime
+from data_entry import DATE_FORMAT, CATEGORIES, SUB_CATEGORIES
+import ledger_writer
+import rollup
+
+THRESHOLDS = [80, 100]
+# limits can be set on any sub-category or category that isn't income
+BUDGET_NAMES = ([name for code, names in SUB_CATEGORIES.items() if code != 'I' for name in names]
+                + [name for code, name in CATEGORIES.items() if code != 'I'])
+
+# returns the path of the budget limits file that sits next to a ledger file
+def limits_path(ledger_file):
+    return os.path.splitext(ledger_file)[0] + '_budgets.json'
+
+# returns the path of the month-to-date spending counters that sit next to a ledger file
+def spending_path(ledger_file):
+    return os.path.splitext(ledger_file)[0] + '_spending.json'
+
+# reads the limits and thresholds, no file means no budgets
+def read_limits(ledger_file):
+    try:
+        with open(limits_path(ledger_file)) as file:
+            budgets = json.load(file)
+    except FileNotFoundError:
+        budgets = {}
+    return {'limits': budgets.get('limits', {}), 'thresholds': sorted(budgets.get('thresholds', THRESHOLDS))}
+
+# sets the monthly limit of a sub-category or category, a limit of 0 removes it
+def set_limit(ledger_file, name:str, amount:float):
+    if name not in BUDGET_NAMES:
+        raise ValueError(f'Invalid budget {name!r}. Use a sub-category or category that is not income.')
+    if amount < 0:
+        raise ValueError('Limit must be non-negative.')
+    budgets = read_limits(ledger_file)
+    if amount:
+        budgets['limits'][name] = amount
+    else:
+        budgets['limits'].pop(name, None)
+    write_json(limits_path(ledger_file), budgets)
+
+# writes json through a temporary file so a crash never leaves it half written
+def write_json(path, data):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(path + '.tmp', path)
+
+# reads the spending counters, returns None if there are no readable counters
+def read_spending(ledger_file):
+    try:
+        with open(spending_path(ledger_file)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# returns the cents spent in each month on each sub-category and category, keyed 'yyyy-mm' -> name -> cents
+def spending_from_totals(totals):
+    months = {}
+    for (month, category, sub_category), cents in totals.items():
+        if category == 'Income':
+            continue
+        spent = months.setdefault(month, {})
+        for name in (sub_category, category):
+            spent[name] = spent.get(name, 0) + cents
+    return months
+
+# rebuilds the counters from every transaction, to reconcile them with the ledger
+# backend is the sqlite backend when transactions are kept in a database
+# runs under the ledger's file lock, so no rows land between reading the ledger and saving its version
+def recompute(ledger_file, date_format=DATE_FORMAT, backend=None):
+    version = rollup.source_version(ledger_file) if backend is None else None
+    # both give amounts in cents
+    if backend is not None:
+        df = backend.monthly_totals().rename(columns={'Sum': 'Amount'})
+    else:
+        import storage
+        df = storage.load_ledger(ledger_file, columns=['Date','Category','Sub-Category','Amount'],
+                                 date_format=date_format)
+        df = df.assign(Month=df['Date'].dt.strftime(rollup.MONTH_FORMAT))
+    grouped = df.groupby(['Month','Category','Sub-Category'], observed=True)['Amount'].sum()
+    months = spending_from_totals({key: int(cents) for key, cents in grouped.items()})
+    # the database's version isn't tracked, its counters are only rebuilt when asked
+    write_json(spending_path(ledger_file), {'source': version, 'months': months})
+    return months
+
+# adds newly appended spending to the counters and returns the alerts of budgets that crossed a threshold
+# totals maps (month, category, sub-category) to cents, previous_version is the ledger version before the append
+# runs under the ledger's file lock, so only the months and budgets touched are looked at
+# backend is the sqlite backend when transactions are kept in a database, whose version isn't checked
+def record_spending(ledger_file, totals, previous_version=None, date_format=DATE_FORMAT, backend=None):
+    added = spending_from_totals(totals)
+    counters = read_spending(ledger_file)
+    if counters is None or (backend is None and counters['source'] != previous_version):
+        # the ledger changed without the counters, so they are rebuilt and already include the new rows
+        months = recompute(ledger_file, date_format, backend)
+        before = {month: {name: months[month][name] - cents for name, cents in spent.items()}
+                  for month, spent in added.items()}
+    else:
+        months = counters['months']
+        before = {month: {name: months.get(month, {}).get(name, 0) for name in spent}
+                  for month, spent in added.items()}
+        for month, spent in added.items():
+            for name, cents in spent.items():
+                months.setdefault(month, {})[name] = before[month][name] + cents
+        write_json(spending_path(ledger_file),
+                   {'source': rollup.source_version(ledger_file) if backend is None else None, 'months': months})
+    return check_alerts(ledger_file, before, months)
+
+# returns a message for each budget whose spending went past a threshold
+def check_alerts(ledger_file, before, months):
+    budgets = read_limits(ledger_file)
+    alerts = []
+    for month, spent in before.items():
+        for name, old_cents in spent.items():
+            limit = budgets['limits'].get(name)
+            if not limit:
+                continue
+            new_cents = months[month][name]
+            # a threshold of t percent of a limit in dollars is limit * t cents
+            crossed = [t for t in budgets['thresholds'] if old_cents < limit * t <= new_cents]
+            if crossed:
+                alerts.append(f'Budget alert: {name} spending for {month} is ${new_cents / 100:.2f}, '
+                              f'{new_cents / limit:.0f}% of its ${limit:.2f} limit')
+    return alerts
+
+# returns the cents of each (month, category, sub-category) of transactions added as dictionaries
+def entry_totals(entries, date_format=DATE_FORMAT):
+    totals = {}
+    for entry in entries:
+        key = (datetime.strptime(entry['Date'], date_format).strftime(rollup.MONTH_FORMAT),
+               entry['Category'], entry['Sub-Category'])
+        totals[key] = totals.get(key, 0) + round(float(entry['Amount']) * 100)
+    return totals
+
+# returns the spending, limit and share of the limit of every budget in a month
+def status(ledger_file, month:str):
+    budgets = read_limits(ledger_file)
+    counters = read_spending(ledger_file) or {'months': {}}
+    spent = {name: cents / 100 for name, cents in counters['months'].get(month, {}).items()}
+    return [(name, spent.get(name, 0), limit, spent.get(name, 0) / limit) for name, limit in budgets['limits'].items()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Set monthly budgets and check spending against them')
+    parser.add_argument('command', choices=['set', 'status', 'recompute'])
+    parser.add_argument('name', nargs='?', help='sub-category or category, for set')
+    parser.add_argument('amount', nargs='?', type=float, help='monthly limit, 0 removes it, for set')
+    parser.add_argument('--ledger', default='transactions.csv')
+    parser.add_argument('--sqlite', metavar='DB_FILE', help='use the sqlite database instead of the csv ledger')
+    parser.add_argument('--month', default=datetime.today().strftime(rollup.MONTH_FORMAT), help='yyyy-mm, for status')
+    args = parser.parse_args()
+
+    backend = None
+    ledger_file = args.ledger
+    if args.sqlite:
+        from sqlite_backend import SQLiteBackend
+        backend = SQLiteBackend(args.sqlite, DATE_FORMAT)
+        ledger_file = args.sqlite
+
+    if args.command == 'set':
+        if args.name is None or args.amount is None:
+            parser.error('set needs a name and an amount')
+        try:
+            set_limit(ledger_file, args.name, args.amount)
+        except ValueError as e:
+            print(e)
+    elif args.command == 'recompute':
+        if backend is not None:
+            recompute(ledger_file, DATE_FORMAT, backend)
+        else:
+            with ledger_writer.FileLock(ledger_file):
+                recompute(ledger_file, DATE_FORMAT)
+        print(f'Recomputed spending counters in {spending_path(ledger_file)}')
+    else:
+        for name, spent, limit, share in status(ledger_file, args.month):
+            print(f'{name:<25} ${spent:>10.2f} of ${limit:>10.2f}  ({share:.0%})')
@@ -0,0 +1,237 @@
+# This file imports bank and card statement files into the ledger in bulk
+
+# importing libraries
+import argparse
+import os
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import budgets
+import chart_cache
+from data_entry import DATE_FORMAT, CATEGORIES, SUB_CATEGORIES
+import duplicates
+import ledger_writer
+import memo_index
+import partitions
+import rollup
+
+COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
+MEMO_LIMIT = 50
+CHUNK_SIZE = 50_000
+# ofx statements have no categories, so spending lands here unless the caller picks otherwise
+DEFAULT_CATEGORY = 'Non-Essential'
+DEFAULT_SUB_CATEGORY = 'Other'
+OFX_DATE_FORMAT = '%Y%m%d'
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+OFX_FIELD = re.compile(r'<(DTPOSTED|TRNAMT|NAME|MEMO)>([^<\r\n]*)', re.I)
+
+# every valid category and sub-category pair joined as 'Category|Sub-Category'
+VALID_PAIRS = {f'{CATEGORIES[code]}|{sub_cat}' for code in SUB_CATEGORIES for sub_cat in SUB_CATEGORIES[code]}
+
+# returns the path of the file that collects rejected rows of a statement
+def rejects_path(statement_file):
+    return os.path.splitext(statement_file)[0] + '_rejected.csv'
+
+# yields chunks of a csv statement renamed to the ledger columns
+def read_csv_statement(statement_file, column_map=None, chunksize=CHUNK_SIZE):
+    for chunk in pd.read_csv(statement_file, dtype=str, keep_default_na=False, chunksize=chunksize):
+        yield chunk.rename(columns=column_map or {})
+
+# yields chunks of an ofx statement in the ledger columns
+def read_ofx_statement(statement_file, chunksize=CHUNK_SIZE):
+    rows = []
+    buffer = ''
+    with open(statement_file, errors='replace') as file:
+        for line in file:
+            buffer += line
+            if '</STMTTRN>' not in line.upper():
+                continue
+            # only keep the text after the last complete transaction in the buffer
+            last_end = 0
+            for match in OFX_TRANSACTION.finditer(buffer):
+                fields = {key.upper(): value.strip() for key, value in OFX_FIELD.findall(match.group(1))}
+                rows.append(ofx_row(fields))
+                last_end = match.end()
+            buffer = buffer[last_end:]
+            if len(rows) >= chunksize:
+                yield pd.DataFrame(rows)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+# maps the fields of one ofx transaction to the ledger columns
+def ofx_row(fields):
+    amount = fields.get('TRNAMT', '')
+    try:
+        date = datetime.strptime(fields.get('DTPOSTED', '')[:8], OFX_DATE_FORMAT).strftime(DATE_FORMAT)
+    except ValueError:
+        date = fields.get('DTPOSTED', '')
+    # credits are income, debits are recorded as positive spending
+    is_credit = not amount.startswith('-')
+    return {
+        'Date': date,
+        'Category': CATEGORIES['I'] if is_credit else '',
+        'Sub-Category': SUB_CATEGORIES['I'][0] if is_credit else '',
+        'Memo': fields.get('NAME') or fields.get('MEMO', ''),
+        'Amount': amount.lstrip('+-')
+    }
+
+# checks every row of a chunk at once, returns the cleaned rows and the rejected rows with a reason
+def validate_chunk(chunk, default_category=DEFAULT_CATEGORY, default_sub_category=DEFAULT_SUB_CATEGORY,
+                   date_format=DATE_FORMAT):
+    original = chunk
+    chunk = chunk.reindex(columns=COLUMNS).fillna('').astype(str)
+    clean = pd.DataFrame(index=chunk.index)
+
+    # category codes like 'E' are accepted as well as full names
+    category = chunk['Category'].str.strip()
+    category = category.where(category != '', default_category)
+    clean['Category'] = category.str.upper().map(CATEGORIES).fillna(category)
+    sub_category = chunk['Sub-Category'].str.strip()
+    clean['Sub-Category'] = sub_category.where(sub_category != '', default_sub_category)
+
+    dates = pd.to_datetime(chunk['Date'].str.strip(), format=date_format, errors='coerce')
+    amounts = pd.to_numeric(chunk['Amount'].str.strip().str.replace(',', '', regex=False), errors='coerce')
+    clean['Date'] = dates.dt.strftime(date_format)
+    clean['Memo'] = chunk['Memo'].str.strip()
+    clean['Amount'] = amounts
+
+    # the first failing check of each row is the reason it is rejected
+    checks = [
+        (dates.isna(), f'invalid date, expected {date_format}'),
+        (dates > datetime.today(), 'date is in the future'),
+        # inf and numbers too big for a float can't be stored in cents
+        (~np.isfinite(amounts), 'invalid amount'),
+        (amounts <= 0, 'amount must be positive'),
+        ((amounts * 100).round() == 0, 'amount is less than a cent'),
+        (clean['Memo'].str.len() > MEMO_LIMIT, f'memo over {MEMO_LIMIT} characters'),
+        (~clean['Category'].isin(CATEGORIES.values()), 'invalid category'),
+        (~(clean['Category'] + '|' + clean['Sub-Category']).isin(VALID_PAIRS), 'invalid sub-category for category'),
+    ]
+    reason = pd.Series('', index=chunk.index)
+    for failed, message in reversed(checks):
+        reason = reason.mask(failed, message)
+
+    rejected = original[reason != ''].assign(Reason=reason[reason != ''])
+    return clean.loc[reason == '', COLUMNS], rejected
+
+# returns the duplicate index keys of a chunk of clean rows
+def chunk_keys(clean, date_format=DATE_FORMAT):
+    return duplicates.ledger_keys(pd.DataFrame({
+        'Date': pd.to_datetime(clean['Date'], format=date_format),
+        'Amount': (clean['Amount'] * 100).round().astype('int64'),
+        'Memo': clean['Memo'],
+        'Sub-Category': clean['Sub-Category'],
+    }))
+
+# adds a chunk of clean rows to the monthly rollup, key and memo indexes and budget counters
+# and drops the charts of those months
+# returns the budget alerts the chunk set off
+def add_chunk_to_rollup(csv_file, clean, previous_version, date_format=DATE_FORMAT):
+    months = pd.to_datetime(clean['Date'], format=date_format).dt.strftime(rollup.MONTH_FORMAT)
+    cents = (clean['Amount'] * 100).round().astype('int64')
+    grouped = cents.groupby([months, clean['Category'], clean['Sub-Category']]).agg(['sum','count','min','max'])
+    totals = {'|'.join(key): [int(row['sum']), int(row['count']), int(row['min']), int(row['max'])]
+              for key, row in grouped.iterrows()}
+    rollup.merge_into_rollup(csv_file, totals, previous_version)
+    duplicates.add_keys(csv_file, chunk_keys(clean, date_format), previous_version, date_format)
+    memo_index.add_memos(csv_file, clean['Memo'].tolist(), previous_version)
+    chart_cache.invalidate(csv_file, months.unique().tolist())
+    return budgets.record_spending(csv_file, {key: int(value) for key, value in grouped['sum'].items()},
+                                   previous_version, date_format)
+
+# inserts a chunk of clean rows into the sqlite backend and updates its key index, budget counters and cached charts
+# returns the budget alerts the chunk set off
+def add_chunk_to_backend(backend, clean, date_format=DATE_FORMAT):
+    months = pd.to_datetime(clean['Date'], format=date_format).dt.strftime(rollup.MONTH_FORMAT)
+    cents = (clean['Amount'] * 100).round().astype('int64')
+    backend.add_entries(clean.to_dict('records'))
+    duplicates.add_keys(backend.db_file, chunk_keys(clean, date_format), backend=backend)
+    chart_cache.invalidate(backend.db_file, months.unique().tolist())
+    return budgets.record_spending(backend.db_file,
+                                   {key: int(value) for key, value in
+                                    cents.groupby([months, clean['Category'], clean['Sub-Category']]).sum().items()},
+                                   date_format=date_format, backend=backend)
+
+# leaves out the duplicates of a validated chunk and writes the rest, runs under the ledger's file lock
+# returns the rows written, the rows rejected and the budget alerts they set off
+def import_chunk(csv_file, chunk, clean, rejected, date_format=DATE_FORMAT, duplicates_action='reject', backend=None):
+    alerts = []
+    if not clean.empty:
+        found = pd.Series(duplicates.find_duplicates(csv_file, chunk_keys(clean, date_format), date_format,
+                                                     backend), index=clean.index)
+        if found.any() and duplicates_action == 'reject':
+            # clean has only the rows that passed validation, so the duplicates are picked from the chunk by label
+            rejected = pd.concat([rejected, chunk.loc[found.index[found.to_numpy()]]
+                                  .assign(Reason='duplicate of a transaction in the ledger')])
+            clean = clean[~found]
+        elif found.any():
+            print(f'{found.sum()} rows match transactions already in the ledger and were imported anyway')
+    if not clean.empty and backend is not None:
+        # one database transaction per chunk
+        alerts = add_chunk_to_backend(backend, clean, date_format)
+    elif not clean.empty:
+        # one write per chunk, with the same line endings as csv.DictWriter
+        alerts = ledger_writer.append_locked(csv_file, clean.to_csv(header=False, index=False, lineterminator='\r\n'),
+                                             lambda previous_version: add_chunk_to_rollup(csv_file, clean,
+                                                                                          previous_version,
+                                                                                          date_format))
+    return clean, rejected, alerts
+
+# streams a statement file into the ledger one chunk at a time
+# rows matching a transaction already in the ledger are rejected, or imported with a warning when duplicates='flag'
+# backend is the sqlite backend when transactions are kept in a database, csv_file is then its database file
+def import_statement(statement_file, csv_file, column_map=None, default_category=DEFAULT_CATEGORY,
+                     default_sub_category=DEFAULT_SUB_CATEGORY, chunksize=CHUNK_SIZE, date_format=DATE_FORMAT,
+                     duplicates_action='reject', backend=None):
+    if statement_file.lower().endswith(('.ofx', '.qfx')):
+        chunks = read_ofx_statement(statement_file, chunksize)
+    else:
+        chunks = read_csv_statement(statement_file, column_map, chunksize)
+
+    # a new ledger needs its header before any rows are appended, partitions get theirs when they are created
+    if backend is None and not os.path.exists(csv_file) and not partitions.is_partitioned(csv_file):
+        pd.DataFrame(columns=COLUMNS).to_csv(csv_file, index=False)
+
+    imported = rejected_count = 0
+    reject_file = rejects_path(statement_file)
+    if os.path.exists(reject_file):
+        os.remove(reject_file)
+
+    for chunk in chunks:
+        clean, rejected = validate_chunk(chunk, default_category, default_sub_category, date_format)
+        # the duplicate lookup and the write of a chunk hold the lock together,
+        # so two imports of the same statement at once can't both add its rows
+        with ledger_writer.FileLock(csv_file):
+            clean, rejected, alerts = import_chunk(csv_file, chunk, clean, rejected, date_format, duplicates_action,
+                                                   backend)
+        for alert in alerts:
+            print(alert)
+        imported += len(clean)
+        if not rejected.empty:
+            rejected.to_csv(reject_file, mode='a', header=not os.path.exists(reject_file), index=False)
+            rejected_count += len(rejected)
+
+    return imported, rejected_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import a bank or card statement (csv or ofx) into the ledger')
+    parser.add_argument('statement_file')
+    parser.add_argument('--ledger', default='transactions.csv')
+    parser.add_argument('--map', nargs='*', default=[], metavar='COLUMN=LEDGER_COLUMN',
+                        help='rename statement columns to ledger columns, e.g. "Description=Memo"')
+    parser.add_argument('--category', default=DEFAULT_CATEGORY, help='category used when a row has none')
+    parser.add_argument('--sub-category', default=DEFAULT_SUB_CATEGORY, help='sub-category used when a row has none')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--duplicates', choices=duplicates.ACTIONS, default='reject',
+                        help='what to do with rows already in the ledger')
+    args = parser.parse_args()
+
+    column_map = dict(pair.split('=', 1) for pair in args.map)
+    imported, rejected = import_statement(args.statement_file, args.ledger, column_map,
+                                          args.category, args.sub_category, args.chunksize,
+                                          duplicates_action=args.duplicates)
+    print(f'Imported {imported} transactions')
+    if rejected:
+        print(f'Rejected {rejected} rows, see {rejects_path(args.statement_file)}')
@@ -0,0 +1,117 @@
+# This file caches rendered charts on disk, keyed by a hash of the data they were drawn from
+
+# importing libraries
+# pandas is only imported to hash chart data, so CSV.add_entry can invalidate the cache without it
+import hashlib
+import json
+import os
+import shutil
+import time
+import profiling
+
+CACHE_LIMIT_MB = 100
+INDEX_FILE = 'index.json'
+
+# returns the directory of the chart cache that sits next to a csv file
+def cache_dir(csv_file):
+    return os.path.splitext(csv_file)[0] + '_charts'
+
+# returns the key of a chart drawn from a dataframe with some parameters
+def chart_key(chart, df, params=None):
+    import pandas as pd
+    digest = hashlib.sha256()
+    digest.update(chart.encode())
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+    digest.update(','.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# reads the cache index, which has the size, months covered and last use of each entry
+def read_index(csv_file):
+    try:
+        with open(os.path.join(cache_dir(csv_file), INDEX_FILE)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+# writes the cache index, through a temporary file so it is never half written
+def write_index(csv_file, index):
+    path = os.path.join(cache_dir(csv_file), INDEX_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(index, file)
+    os.replace(path + '.tmp', path)
+
+# returns the cached file of a key, or None on a miss
+def get(csv_file, key):
+    index = read_index(csv_file)
+    entry = index.get(key)
+    if entry is None:
+        return None
+    path = os.path.join(cache_dir(csv_file), entry['file'])
+    if not os.path.exists(path):
+        return None
+    entry['last_used'] = time.time()
+    write_index(csv_file, index)
+    return path
+
+# stores a rendered chart file under a key and evicts the least recently used entries over the limit
+def put(csv_file, key, source_path, months, limit_mb=CACHE_LIMIT_MB):
+    os.makedirs(cache_dir(csv_file), exist_ok=True)
+    file_name = key + os.path.splitext(source_path)[1]
+    path = os.path.join(cache_dir(csv_file), file_name)
+    if os.path.abspath(source_path) != os.path.abspath(path):
+        shutil.copyfile(source_path, path)
+
+    index = read_index(csv_file)
+    index[key] = {'file': file_name, 'size': os.path.getsize(path), 'months': months, 'last_used': time.time()}
+    evict(csv_file, index, limit_mb)
+    write_index(csv_file, index)
+    return path
+
+# removes the least recently used entries until the cache fits in the limit
+def evict(csv_file, index, limit_mb=CACHE_LIMIT_MB):
+    total = sum(entry['size'] for entry in index.values())
+    for key in sorted(index, key=lambda key: index[key]['last_used']):
+        if total <= limit_mb * 1024 * 1024:
+            break
+        total -= index[key]['size']
+        remove_entry(csv_file, index, key)
+
+# removes one entry and its file from the cache
+def remove_entry(csv_file, index, key):
+    try:
+        os.remove(os.path.join(cache_dir(csv_file), index.pop(key)['file']))
+    except FileNotFoundError:
+        pass
+
+# drops every chart whose data covers a month that just got new transactions
+def invalidate(csv_file, months):
+    index = read_index(csv_file)
+    stale = [key for key, entry in index.items()
+             if entry['months'] is None or any(entry['months'][0] <= month <= entry['months'][1] for month in months)]
+    if stale:
+        for key in stale:
+            remove_entry(csv_file, index, key)
+        write_index(csv_file, index)
+
+# returns the cached image of a chart, drawing and storing it first on a miss
+# months is the first and last month ('yyyy-mm') the chart's data covers, used to invalidate it
+def render(csv_file, chart, draw, df, months, fmt='png', params=None):
+    import matplotlib.pyplot as plt
+    key = chart_key(chart, df, params)
+    path = get(csv_file, key)
+    if path is not None:
+        return path
+
+    with profiling.stage(f'render.{chart}', rows_in=len(df)):
+        fig = draw(df, show=False)
+        path = store(csv_file, key, fig, months, fmt)
+        plt.close(fig)
+    return path
+
+# saves a drawn figure as the cached image of a chart key, leaving the figure open, returns the image's path
+def store(csv_file, key, fig, months, fmt='png'):
+    os.makedirs(cache_dir(csv_file), exist_ok=True)
+    path = os.path.join(cache_dir(csv_file), f'{key}.{fmt}')
+    fig.savefig(path, bbox_inches='tight')
+    return put(csv_file, key, path, months)
@@ -0,0 +1,105 @@
+# This file computes the small tables each chart plots, so data_visuals only has to draw them
+
+# importing libraries
+import numpy as np
+import pandas as pd
+import profiling
+import rollup
+import storage
+
+CHARTS = ['cash_flow', 'categorical_expenses', 'subcat_expenses', 'monthly_spending']
+
+# returns the totals in cents of each month, category and sub-category with the first day of the month as a timestamp
+# they come from the rollup of the csv file, or from a grouped query when a database backend is used
+@profiling.timed('load_monthly_totals')
+def load_monthly_totals(csv_file, date_format, backend=None):
+    if backend is not None:
+        monthly = backend.monthly_totals()
+    else:
+        monthly = rollup.load_rollup(csv_file, date_format)
+    monthly['Month_Start'] = pd.PeriodIndex(monthly['Month'], freq='M').to_timestamp()
+    return monthly
+
+# returns the non-income transactions between two months, the only rows the cumulative spending chart needs
+@profiling.timed('load_daily_rows')
+def load_daily_rows(csv_file, date_format, first_month, last_month, backend=None):
+    filters = {'Start Date': first_month.start_time, 'End Date': last_month.end_time.normalize()}
+    columns = ['Date','Category','Amount']
+    if backend is not None:
+        df = backend.load_transactions(columns, filters)
+    else:
+        df = storage.query_ledger(csv_file, filters, columns=columns, date_format=date_format)
+    return df[df['Category'] != 'Income']
+
+# groups the monthly totals up to a month once, every monthly chart is cut from this small table
+def group_monthly(monthly, period):
+    monthly = monthly[monthly['Month_Start'] <= period.start_time]
+    return (monthly.assign(Year=monthly['Month_Start'].dt.year,
+                           Month=monthly['Month_Start'].dt.month,
+                           # all categories not income are considered expense
+                           Type=np.where(monthly['Category'] == 'Income', 'Income', 'Expense'),
+                           Category=monthly['Category'].astype(str),
+                           SubCategory=monthly['Sub-Category'].astype(str))
+                   .groupby(['Year','Month','Type','SubCategory'])['Sum'].sum()
+                   # summed in cents, charts show dollars
+                   .div(100)
+                   .reset_index()
+                   .rename(columns={'SubCategory': 'Sub-Category', 'Sum': 'Amount'}))
+
+# returns income and expense of each month
+def cash_flow_table(grouped):
+    return (grouped.groupby(['Month','Type'])['Amount'].sum()
+                   .reset_index()
+                   .rename(columns={'Type': 'Category'}))
+
+# returns the total of each sub-category that isn't income
+def categorical_table(grouped):
+    return grouped[grouped['Type'] == 'Expense'].groupby('Sub-Category')['Amount'].sum().reset_index()
+
+# returns the expenses of each month and sub-category in a year, largest first
+def subcat_table(grouped, year):
+    spending = grouped[(grouped['Type'] == 'Expense') & (grouped['Year'] == year)]
+    return (spending.groupby(['Month','Sub-Category'])['Amount'].sum()
+                    .reset_index()
+                    .sort_values('Amount', ascending=False))
+
+# returns the running total of spending at the end of each day of a month and the month before it
+def cumsum_table(daily_rows, period):
+    months = daily_rows['Date'].dt.to_period('M')
+    rows = daily_rows[months.isin([period - 1, period])]
+    daily = (rows.assign(Month_Period=rows['Date'].dt.to_period('M'), Day=rows['Date'].dt.day)
+                 .groupby(['Month_Period','Day'])['Amount'].sum()
+                 .reset_index())
+    # added up in cents, charts show dollars
+    daily['CumSum'] = daily.groupby('Month_Period')['Amount'].cumsum() / 100
+    daily['Amount'] = daily['Amount'] / 100
+    return daily
+
+# returns every chart's table for a month, with the first and last month ('yyyy-mm') its data covers
+@profiling.timed('chart_tables')
+def tables_for_period(monthly, period, daily_rows=None, charts=CHARTS):
+    grouped = group_monthly(monthly, period)
+    first_month = monthly['Month'].min()
+    tables = {}
+    if 'cash_flow' in charts:
+        tables['cash_flow'] = (cash_flow_table(grouped), [first_month, str(period)])
+    if 'categorical_expenses' in charts:
+        tables['categorical_expenses'] = (categorical_table(grouped), [first_month, str(period)])
+    if 'subcat_expenses' in charts:
+        tables['subcat_expenses'] = (subcat_table(grouped, period.year), [f'{period.year}-01', str(period)])
+    if 'monthly_spending' in charts and daily_rows is not None:
+        tables['monthly_spending'] = (cumsum_table(daily_rows, period), [str(period - 1), str(period)])
+    return tables
+
+# returns the latest month that has transactions
+def latest_period(monthly):
+    return pd.Period(monthly['Month'].max(), freq='M')
+
+# loads only what the requested charts need and returns their tables for a month, the latest one by default
+def compute(csv_file, date_format, backend=None, period=None, charts=CHARTS):
+    monthly = load_monthly_totals(csv_file, date_format, backend)
+    period = period or latest_period(monthly)
+    daily_rows = None
+    if 'monthly_spending' in charts:
+        daily_rows = load_daily_rows(csv_file, date_format, period - 1, period, backend)
+    return tables_for_period(monthly, period, daily_rows, charts)
@@ -0,0 +1,93 @@
+# This file summarizes ledgers too big for memory by reading them in bounded chunks
+
+# importing libraries
+import argparse
+import gzip
+import numpy as np
+import pandas as pd
+import partitions
+
+DATE_FORMAT = "%m-%d-%Y"
+MONTH_FORMAT = "%Y-%m"
+MEMORY_CAP_MB = 256
+# rough number of bytes pandas needs per byte of csv text for a parsed chunk
+PANDAS_OVERHEAD = 10
+SAMPLE_LINES = 1000
+TOTAL_COLUMNS = ['Income','Spent','Savings','Count']
+
+# returns how many rows fit in one chunk under the memory cap, estimated from the first lines of the file
+def rows_per_chunk(csv_file, memory_cap_mb=MEMORY_CAP_MB):
+    with (gzip.open if partitions.is_compressed(csv_file) else open)(csv_file, 'rb') as file:
+        file.readline()
+        sample = [len(line) for _, line in zip(range(SAMPLE_LINES), file)]
+    bytes_per_row = (sum(sample) / len(sample) if sample else 64) * PANDAS_OVERHEAD
+    return max(int(memory_cap_mb * 1024 * 1024 / bytes_per_row), 1)
+
+# returns the income, spent, savings and count of one chunk for each month, in cents
+def summarize_chunk(chunk, start_date=None, end_date=None, date_format=DATE_FORMAT):
+    dates = pd.to_datetime(chunk['Date'], format=date_format)
+    in_range = np.ones(len(chunk), dtype=bool)
+    if start_date is not None:
+        in_range &= (dates >= start_date).to_numpy()
+    if end_date is not None:
+        in_range &= (dates <= end_date).to_numpy()
+
+    category = chunk['Category']
+    # amounts are added up as whole cents so the order of the chunks can't change the totals
+    cents = (chunk['Amount'] * 100).round().astype('int64')
+    # same groups as CSV.get_summary and functions.get_table_totals
+    partial = pd.DataFrame({
+        'Month': dates.dt.strftime(MONTH_FORMAT),
+        'Income': cents.where(category == 'Income', 0),
+        'Spent': cents.where(~category.isin(['Income','Savings']), 0),
+        'Savings': cents.where(category == 'Savings & Investments', 0),
+        'Count': 1
+    })
+    return partial[in_range].groupby('Month')[TOTAL_COLUMNS].sum()
+
+# adds the partial totals of one chunk to the running totals of each month
+def merge_partial(totals, partial):
+    for month, row in zip(partial.index, partial.to_numpy()):
+        if month in totals:
+            totals[month] += row
+        else:
+            totals[month] = row.copy()
+
+# streams the ledger and returns the totals of each month between two dates, amounts in dollars
+# a partitioned ledger only streams the partitions overlapping the dates
+def summarize(csv_file, start_date=None, end_date=None, memory_cap_mb=MEMORY_CAP_MB, date_format=DATE_FORMAT):
+    totals = {}
+    for path in partitions.ledger_files(csv_file, start_date, end_date):
+        chunks = pd.read_csv(path, usecols=['Date','Category','Amount'], dtype={'Date': str, 'Category': str},
+                             chunksize=rows_per_chunk(path, memory_cap_mb))
+        for chunk in chunks:
+            merge_partial(totals, summarize_chunk(chunk, start_date, end_date, date_format))
+
+    monthly = pd.DataFrame.from_dict(totals, orient='index', columns=TOTAL_COLUMNS).sort_index()
+    monthly.index.name = 'Month'
+    for col in ['Income','Spent','Savings']:
+        monthly[col] = monthly[col] / 100
+    return monthly
+
+# returns the overall totals of a monthly summary
+def overall_totals(monthly):
+    cents = (monthly[['Income','Spent','Savings']] * 100).round().astype('int64').sum()
+    return {'Income': cents['Income'] / 100, 'Spent': cents['Spent'] / 100,
+            'Savings': cents['Savings'] / 100, 'Count': int(monthly['Count'].sum())}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarize a ledger in chunks without loading it into memory')
+    parser.add_argument('csv_file', nargs='?', default='transactions.csv')
+    parser.add_argument('--start', help='start date (mm-dd-yyyy)')
+    parser.add_argument('--end', help='end date (mm-dd-yyyy)')
+    parser.add_argument('--memory-mb', type=float, default=MEMORY_CAP_MB, help='memory cap for each chunk')
+    args = parser.parse_args()
+
+    start = pd.to_datetime(args.start, format=DATE_FORMAT) if args.start else None
+    end = pd.to_datetime(args.end, format=DATE_FORMAT) if args.end else None
+    monthly = summarize(args.csv_file, start, end, args.memory_mb)
+    totals = overall_totals(monthly)
+    print(monthly.to_string())
+    print(f"\nTotal Income: ${totals['Income']}")
+    print(f"Total Spent: ${totals['Spent']}")
+    print(f"Total Savings: ${totals['Savings']}")
@@ -2,6 +2,7 @@
 
 # importing libraries
 from datetime import datetime
+import math
 
 DATE_FORMAT = "%m-%d-%Y"
 CATEGORIES = {'I': 'Income',
@@ -95,6 +96,8 @@ def get_memo():
 def get_amount():
     try:
         amount = float(input('Enter the amount: '))
+        if not math.isfinite(amount):
+            raise ValueError(f'Invalid amount {amount!r}. Enter a number.')
         if amount <= 0:
             raise ValueError('Amount must be non-negative.')
         return amount
@@ -102,4 +105,26 @@ def get_amount():
         print()
         print(e)
         print()
-        return get_amount()
\ No newline at end of file
+        return get_amount()
+
+# checks a transaction given all at once instead of through the prompts above, raises ValueError if invalid
+# returns the full category name, since the category can be given as its code
+def check_entry(date, category, sub_category, memo, amount, date_format=DATE_FORMAT,
+                categories=CATEGORIES, sub_cats=SUB_CATEGORIES):
+    try:
+        if datetime.strptime(date, date_format) > datetime.today():
+            raise ValueError('Date cannot be in the future.')
+    except ValueError as e:
+        raise ValueError(f'Invalid date {date!r}. {e}') from None
+    category = categories.get(category.upper(), category)
+    if category not in categories.values():
+        raise ValueError(f'Invalid category {category!r}. Use one of: {", ".join(categories)}')
+    if sub_category not in sub_cats[category[0]]:
+        raise ValueError(f'Invalid sub-category {sub_category!r}. Use one of: {", ".join(sub_cats[category[0]])}')
+    if len(memo) > 50:
+        raise ValueError('Memo passed character limit of 50 characters.')
+    if not math.isfinite(amount):
+        raise ValueError(f'Invalid amount {amount!r}. Enter a number.')
+    if amount <= 0:
+        raise ValueError('Amount must be non-negative.')
+    return category
@@ -2,27 +2,24 @@
 
 # importing libraries
 import matplotlib.pyplot as plt
-import pandas as pd
 import seaborn as sns
 import numpy as np
 import calendar
+import chart_cache
+import chart_data
+import profiling
 
-# draws cash flow plot for each month
-def draw_cash_flow(df):
-    cash_flow_df = df.copy()
-
-    # all categories not income are considered expense
-    cash_flow_df.loc[cash_flow_df['Category'] != "Income", 'Category'] = "Expense"
-    # get the totals for each category of each month
-    cash_flow_df = cash_flow_df.groupby(['Month','Category'])[['Amount']].sum().reset_index()
+# draws cash flow plot for each month from a table of income and expense per month
+@profiling.timed('draw_cash_flow')
+def draw_cash_flow(cash_flow_df, show=True):
     # determining palette for each category
     palette = {'Income': '#4bd02b', 'Expense': '#e33434'}
 
-    # create net income for each month to display at top of plot
-    net_income_df = df.copy()
-    net_income_df.loc[net_income_df['Category'] != 'Income', 'Amount'] *= -1
-    net_income_df = net_income_df.groupby(['Month'])[['Amount']].sum().reset_index()
-    net_income = net_income_df.loc[net_income_df['Month']== net_income_df['Month'].max(), 'Amount'].values[0]
+    # net income of the latest month to display at top of plot
+    last_month = cash_flow_df['Month'].max()
+    last_month_df = cash_flow_df.loc[cash_flow_df['Month'] == last_month]
+    net_income = (last_month_df.loc[last_month_df['Category'] == 'Income', 'Amount'].sum()
+                  - last_month_df.loc[last_month_df['Category'] == 'Expense', 'Amount'].sum())
 
     fig, ax = plt.subplots()
     
@@ -62,7 +59,7 @@ def draw_cash_flow(df):
     ax.text(
         x=0.05 + bbox_width +  0.27,
         y=0.95 - bbox_height - 0.02,
-        s=f"{calendar.month_abbr[net_income_df['Month'].max()]} Net Income",
+        s=f"{calendar.month_abbr[last_month]} Net Income",
         fontdict={"fontsize":12},
         horizontalalignment='left',
         verticalalignment='top',
@@ -71,14 +68,18 @@ def draw_cash_flow(df):
     for container in ax.containers:
         ax.bar_label(container)
 
+    # reports render without a window and save the figure instead
+    if not show:
+        return fig
     return plt.show()
 
-# returns a pie chart displaying sub-categorical expenses
-def draw_categorical_expenses(df):
+# returns a pie chart displaying sub-categorical expenses from a table of totals per sub-category
+@profiling.timed('draw_categorical_expenses')
+def draw_categorical_expenses(sub_cat_df, show=True):
     def my_autopct(pct):
         return ('%.2f%%' % pct) if pct > 90 else ''
 
-    sub_cat_df = df.loc[df["Category"] != "Income"].groupby('Sub-Category')[['Amount']].sum()
+    sub_cat_df = sub_cat_df.set_index('Sub-Category')
 
     # TODO: fix pie chart to display labels over 15% of total transactions
     fig, ax = plt.subplots()
@@ -90,15 +91,15 @@ def draw_categorical_expenses(df):
     ax.set_title('Categorical Expenses')
     plt.tight_layout()
 
+    if not show:
+        return fig
     return plt.show()
 
-# returns a bar plot displaying expenses by month colored by sub-category
-def draw_subcat_expenses(df):
-    # getting data for transactions in the current year
-    current_year_df = df.loc[df['Date_Formatted'].dt.to_period('Y') == df['Date_Formatted'].dt.to_period('Y').max()]
-
+# returns a bar plot displaying expenses by month colored by sub-category, from a table of one year
+@profiling.timed('draw_subcat_expenses')
+def draw_subcat_expenses(subcat_df, show=True):
     fig, ax = plt.subplots(figsize=(10,6))
-    sns.barplot(current_year_df.loc[current_year_df['Category'] != 'Income'].groupby(['Month','Sub-Category'])[['Amount']].sum().sort_values('Amount', ascending=False),
+    sns.barplot(subcat_df,
                 x='Amount',
                 y='Month',
                 hue="Sub-Category",
@@ -109,17 +110,17 @@ def draw_subcat_expenses(df):
     ax.set_ylabel('Month')
     plt.tight_layout()
 
+    if not show:
+        return fig
     return plt.show()
 
 # returns cumulative sum of current month to compare to previous month
-def draw_cumsum_plot(df):
-    # create df for cumulative sum plot
-    cumsum_df=df.loc[df['Category'] != 'Income']
-    # create cumulative sum column
-    cumsum_df['CumSum'] = cumsum_df.groupby('Month_Period')['Amount'].cumsum()
+# from a table of the running total at the end of each day of both months
+@profiling.timed('draw_cumsum_plot')
+def draw_cumsum_plot(cumsum_df, show=True):
     # get the current month and previous month
     curr_month = cumsum_df['Month_Period'].max()
-    prev_month = curr_month - 1 if curr_month != 1 else 12
+    prev_month = curr_month - 1
 
     # create two different datasets to plot
     curr_month_df = cumsum_df.loc[cumsum_df['Month_Period'] == curr_month]
@@ -175,45 +176,61 @@ def draw_cumsum_plot(df):
             )
     plt.tight_layout()
 
+    if not show:
+        return fig
+    return plt.show()
+
+# shows a chart from the chart cache, drawing it only if the data changed since it was last drawn
+# a chart drawn on a miss is shown as a live figure and stored for next time, a hit is shown as the stored image
+def show_cached_chart(csv_file, chart, draw, table, months):
+    key = chart_cache.chart_key(chart, table)
+    path = chart_cache.get(csv_file, key)
+    if path is None:
+        fig = draw(table, show=False)
+        chart_cache.store(csv_file, key, fig, months)
+        return plt.show()
+    image = plt.imread(path)
+    dpi = plt.rcParams['figure.dpi']
+    fig = plt.figure(figsize=(image.shape[1] / dpi, image.shape[0] / dpi))
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(image)
+    ax.axis('off')
     return plt.show()
 
+DRAW = {
+    'cash_flow': draw_cash_flow,
+    'categorical_expenses': draw_categorical_expenses,
+    'subcat_expenses': draw_subcat_expenses,
+    'monthly_spending': draw_cumsum_plot,
+}
+# chart shown for each menu option
+CHOICES = {1: 'cash_flow', 2: 'categorical_expenses', 3: 'subcat_expenses', 4: 'monthly_spending'}
+
 # main function to view different plots
-def plot(PLOTS, df):
+def plot(PLOTS, csv_file, date_format, backend=None):
     print()
     print(f"{'*' * 15} Available Charts {'*' * 15}")
     for plot in PLOTS:
         print(f"{plot} - {PLOTS[plot]}")
 
     choice = int(input('\nWhich visual would you like to view? '))
+    # charts are cached next to whichever file holds the transactions
+    source = backend.db_file if backend is not None else csv_file
     
     try:
         if choice == 0:
             return
-        elif choice == 1:
-            draw_cash_flow(df)
-        elif choice == 2:
-            draw_categorical_expenses(df)
-        elif choice == 3:
-            draw_subcat_expenses(df)
-        elif choice == 4:
-            draw_cumsum_plot(df)
+        chart = CHOICES[choice]
+        # only the months this chart needs are loaded and aggregated
+        table, months = chart_data.compute(csv_file, date_format, backend, charts=[chart])[chart]
+        show_cached_chart(source, chart, DRAW[chart], table, months)
     # user must choose one of the options above
     except KeyError:
         print('\nInvalid option. Please enter an option from the available list.\n')
-        plot(PLOTS)
+        plot(PLOTS, csv_file, date_format, backend)
 
-def main(csv_file):
-    # manipulate dataset before calling PLOT function
+def main(csv_file, backend=None):
     DATE_FORMAT = '%m-%d-%Y'
-    df = pd.read_csv(csv_file)
-
-    visuals_df = df.copy().sort_values('Date')
-    visuals_df['Date_Formatted'] = pd.to_datetime(visuals_df['Date'], format=DATE_FORMAT)
-    visuals_df['Month'] = visuals_df['Date_Formatted'].dt.month
-    visuals_df['Day'] = visuals_df['Date_Formatted'].dt.day
-    visuals_df['Month_Period'] = visuals_df['Date_Formatted'].dt.to_period('M')
-
-    # TODO: Add Month_Period Column to dataframe to be able to get most recent month
 
     PLOTS = {
         0: 'Exit',
@@ -223,9 +240,9 @@ def main(csv_file):
         4: 'Monthly Spending',
     }
 
-    plot(PLOTS, visuals_df)
+    plot(PLOTS, csv_file, DATE_FORMAT, backend)
 
 if __name__ == "__main__":
     csv_file = 'transactions.csv'
     
-    main(csv_file)
\ No newline at end of file
+    main(csv_file)
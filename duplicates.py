@@ -0,0 +1,230 @@
+# This file finds duplicate transactions through an index of hashed keys kept next to the ledger,
+# and finds recurring transactions like subscriptions and bills across the whole history
+
+# importing libraries
+# the index is a small sqlite file so checking an entry looks up its key instead of loading every key,
+# pandas is only imported to rebuild the index or scan the ledger
+import argparse
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+from data_entry import DATE_FORMAT
+import ledger_writer
+import rollup
+
+# 'flag' adds duplicates with a warning, 'reject' leaves them out
+ACTIONS = ['flag', 'reject']
+# the most keys looked up in one query, below sqlite's limit on parameters
+LOOKUP_BATCH = 500
+# a group of transactions is recurring if it happened this many times at one of these intervals (in days)
+MIN_OCCURRENCES = 3
+PERIODS = {'weekly': 7, 'biweekly': 14, 'monthly': 30.44, 'quarterly': 91.31, 'yearly': 365.25}
+# share of the gaps that have to be within the tolerance of the period
+REGULAR_SHARE = 0.8
+
+# returns the path of the key index that sits next to a ledger file
+def index_path(ledger_file):
+    return os.path.splitext(ledger_file)[0] + '_keys.db'
+
+# returns the normalized key of a transaction: ISO date, amount in cents, memo without case or extra spaces
+def normalize(date:str, cents:int, memo:str, sub_category:str):
+    return f"{date}|{cents}|{' '.join(memo.lower().split())}|{sub_category}"
+
+# returns a 64-bit hash of a key, stored as a sqlite integer
+def key_hash(key:str):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+# returns the hashed keys of transactions added as dictionaries
+def entry_keys(entries, date_format=DATE_FORMAT):
+    return [key_hash(normalize(datetime.strptime(entry['Date'], date_format).strftime('%Y-%m-%d'),
+                               round(float(entry['Amount']) * 100), entry['Memo'] or '', entry['Sub-Category']))
+            for entry in entries]
+
+# returns memos without case or extra spaces, like normalize does for one memo
+def normalize_memos(memos):
+    return memos.astype(str).str.lower().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+# returns the hashed keys of a typed ledger (dates as timestamps and amounts in cents)
+def ledger_keys(df):
+    if df.empty:
+        return []
+    # a missing amount gives an empty one, so its row still gets a key
+    keys = (df['Date'].dt.strftime('%Y-%m-%d') + '|' + df['Amount'].astype(str).fillna('') + '|'
+            + normalize_memos(df['Memo'])
+            + '|' + df['Sub-Category'].astype(str))
+    return list(map(key_hash, keys))
+
+# opens the index, creating its tables the first time
+def connect(ledger_file):
+    conn = sqlite3.connect(index_path(ledger_file))
+    conn.execute('CREATE TABLE IF NOT EXISTS keys (hash INTEGER PRIMARY KEY, count INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+    return conn
+
+# returns the ledger version the index was built from, like the rollup keeps it
+def indexed_version(conn):
+    row = conn.execute("SELECT value FROM meta WHERE name = 'source'").fetchone()
+    return row[0] if row else None
+
+# records which ledger version the index matches, None for a database whose version isn't tracked
+def set_version(conn, ledger_file, backend=None):
+    version = None if backend is not None else str(rollup.source_version(ledger_file))
+    conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('source', ?)", (version,))
+
+# rebuilds the index from every transaction in the ledger
+def rebuild(ledger_file, date_format=DATE_FORMAT, backend=None):
+    import pandas as pd
+    import storage
+    if backend is not None:
+        df = backend.load_transactions(['Date','Sub-Category','Memo','Amount'])
+    else:
+        df = storage.load_ledger(ledger_file, columns=['Date','Sub-Category','Memo','Amount'], date_format=date_format)
+    counts = pd.Series(ledger_keys(df), dtype='int64').value_counts()
+
+    conn = connect(ledger_file)
+    try:
+        with conn:
+            conn.execute('DELETE FROM keys')
+            conn.executemany('INSERT INTO keys (hash, count) VALUES (?, ?)',
+                             zip(counts.index.tolist(), counts.tolist()))
+            set_version(conn, ledger_file, backend)
+    finally:
+        conn.close()
+    return int(counts.sum())
+
+# rebuilds the index if the csv ledger changed since it was built, holding the lock so no rows land meanwhile
+# locked is True when the caller already holds the lock
+def ensure_current(ledger_file, date_format=DATE_FORMAT, backend=None, locked=False):
+    conn = connect(ledger_file)
+    try:
+        version = indexed_version(conn)
+        empty = conn.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0
+    finally:
+        conn.close()
+    if backend is not None:
+        if empty:
+            rebuild(ledger_file, date_format, backend)
+        return
+    if version != str(rollup.source_version(ledger_file)):
+        if locked:
+            rebuild(ledger_file, date_format)
+        else:
+            with ledger_writer.FileLock(ledger_file):
+                rebuild(ledger_file, date_format)
+
+# returns how many times each key is already in the ledger
+def lookup(conn, keys):
+    counts = {}
+    unique = list(set(keys))
+    for i in range(0, len(unique), LOOKUP_BATCH):
+        batch = unique[i:i + LOOKUP_BATCH]
+        counts.update(conn.execute(f"SELECT hash, count FROM keys WHERE hash IN ({', '.join('?' * len(batch))})",
+                                   batch).fetchall())
+    return counts
+
+# returns which of the keys are duplicates of transactions already in the ledger
+# a key repeated within the new rows only counts as a duplicate as many times as the ledger already has it,
+# so importing a statement twice is caught but two identical purchases on one statement are not
+# runs under the ledger's file lock along with the write of the new rows, so two adds of the same row
+# can't both pass the check
+def find_duplicates(ledger_file, keys, date_format=DATE_FORMAT, backend=None):
+    ensure_current(ledger_file, date_format, backend, locked=True)
+    conn = connect(ledger_file)
+    try:
+        existing = lookup(conn, keys)
+    finally:
+        conn.close()
+    seen = {}
+    duplicates = []
+    for key in keys:
+        seen[key] = seen.get(key, 0) + 1
+        duplicates.append(seen[key] <= existing.get(key, 0))
+    return duplicates
+
+# adds the keys of newly appended rows to the index, runs under the ledger's file lock
+# previous_version is the ledger version before the append, a stale index is rebuilt and already has the rows
+def add_keys(ledger_file, keys, previous_version=None, date_format=DATE_FORMAT, backend=None):
+    conn = connect(ledger_file)
+    try:
+        stale = backend is None and indexed_version(conn) != str(previous_version)
+        if not stale:
+            with conn:
+                conn.executemany('INSERT INTO keys (hash, count) VALUES (?, 1) '
+                                 'ON CONFLICT (hash) DO UPDATE SET count = count + 1', [(key,) for key in keys])
+                set_version(conn, ledger_file, backend)
+    finally:
+        conn.close()
+    if stale:
+        rebuild(ledger_file, date_format, backend)
+
+# returns the transactions that share a key with an earlier one, in one pass over the ledger
+def duplicate_rows(df):
+    import pandas as pd
+    keys = pd.Series(ledger_keys(df), index=df.index)
+    return df[keys.duplicated()]
+
+# returns each group of transactions with the same memo, amount and sub-category that repeats at a regular interval
+# grouping is a single hash pass, and the ledger is already in date order so sorting it is close to linear
+def recurring(df, sub_categories=None, min_occurrences=MIN_OCCURRENCES):
+    import numpy as np
+    import pandas as pd
+    if sub_categories:
+        df = df[df['Sub-Category'].isin(sub_categories)]
+    df = df.assign(Memo=normalize_memos(df['Memo']),
+                   SubCategory=df['Sub-Category'].astype(str))
+    df = df.sort_values('Date', kind='stable')
+    grouped = df.groupby(['Memo','Amount','SubCategory'], sort=False)
+    df = df.assign(Group=grouped.ngroup(), Gap=grouped['Date'].diff().dt.days)
+
+    groups = df.groupby('Group').agg(Memo=('Memo', 'first'), Amount=('Amount', 'first'),
+                                     SubCategory=('SubCategory', 'first'), Count=('Date', 'size'),
+                                     First=('Date', 'min'), Last=('Date', 'max'), Interval=('Gap', 'median'))
+    groups = groups[groups['Count'] >= min_occurrences]
+
+    # each group takes the period closest to its median gap
+    names = np.array(list(PERIODS))
+    days = np.array(list(PERIODS.values()))
+    nearest = np.abs(groups['Interval'].to_numpy()[:, None] - days[None, :]).argmin(axis=1)
+    groups = groups.assign(Period=names[nearest], Period_Days=days[nearest])
+
+    # a group is regular if most of its gaps are within a tenth of the period (at least 3 days)
+    period_days = df['Group'].map(groups['Period_Days'])
+    regular = (df['Gap'] - period_days).abs() <= np.maximum(period_days * 0.1, 3)
+    share = regular[df['Gap'].notna()].groupby(df['Group']).mean()
+    groups = groups[share.reindex(groups.index).fillna(0) >= REGULAR_SHARE]
+
+    groups = groups.assign(Next=groups['Last'] + pd.to_timedelta(groups['Period_Days'].round(), unit='D'))
+    return (groups.drop(columns='Period_Days')
+                  .rename(columns={'SubCategory': 'Sub-Category'})
+                  .sort_values(['Sub-Category','Memo'])
+                  .reset_index(drop=True))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find duplicate and recurring transactions')
+    parser.add_argument('command', choices=['rebuild', 'duplicates', 'recurring'])
+    parser.add_argument('--ledger', default='transactions.csv')
+    parser.add_argument('--sqlite', metavar='DB_FILE', help='use the sqlite database instead of the csv ledger')
+    parser.add_argument('--sub-category', nargs='*', help='only look for recurring transactions in these')
+    args = parser.parse_args()
+
+    backend = None
+    ledger_file = args.ledger
+    if args.sqlite:
+        from sqlite_backend import SQLiteBackend
+        backend = SQLiteBackend(args.sqlite, DATE_FORMAT)
+        ledger_file = args.sqlite
+
+    if args.command == 'rebuild':
+        # the lock keeps rows from landing between reading the ledger and saving its version
+        with ledger_writer.FileLock(ledger_file):
+            count = rebuild(ledger_file, DATE_FORMAT, backend)
+        print(f'Indexed {count} transactions in {index_path(ledger_file)}')
+    else:
+        import storage
+        df = backend.load_transactions() if backend is not None else storage.load_ledger(ledger_file)
+        if args.command == 'duplicates':
+            print(storage.to_display(duplicate_rows(df)).to_string())
+        else:
+            result = recurring(df, args.sub_category)
+            print(result.assign(Amount=result['Amount'] / 100).to_string())
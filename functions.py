@@ -3,30 +3,39 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import calendar
+import storage
+import chunked_summary
+import memo_index
+import profiling
 
-def filter_transaction_dataframe(df, filters):
-    filtered_df = df.copy()
-    if filters["Start Date"] or filters["End Date"]:
-        if filters["Start Date"]:
-            filtered_df = filtered_df[filtered_df["Date"] >= filters["Start Date"]]
-        if filters["End Date"]:
-            filtered_df = filtered_df[filtered_df["Date"] <= filters["End Date"]]
-    if filters["Category"]:
-            filtered_df = filtered_df[filtered_df["Category"].isin(filters["Category"])]
-    if filters["Sub-Category"]:
-            filtered_df = filtered_df[filtered_df["Sub-Category"].isin(filters["Sub-Category"])]
-    if filters["Lower Amount"] or filters["Upper Amount"]:
-         if filters["Lower Amount"]:
-            filtered_df = filtered_df[filtered_df["Amount"] >= filters["Lower Amount"]]
-         if filters["Upper Amount"]:
-            filtered_df = filtered_df[filtered_df["Amount"] <= filters["Upper Amount"]]
-    
-    return filtered_df
+# keyword and memo prefix filters use the memo index of csv_file when it is given,
+# which needs df to be rows of that ledger with their position in the file as index, like storage.load_ledger returns
+@profiling.timed('filter_transaction_dataframe')
+def filter_transaction_dataframe(df, filters, csv_file=None):
+    predicates = storage.filter_predicates(filters)
+    if not predicates:
+        return df
+    memo_predicates, other_predicates = storage.split_memo_predicates(predicates)
+    if csv_file is None or not memo_predicates or df.empty:
+        return df[storage.dataframe_mask(df, predicates)]
+    mask = storage.dataframe_mask(df, other_predicates)
+    mask &= memo_index.row_mask(csv_file, memo_predicates, df.index.max() + 1)[df.index]
+    return df[mask]
 
+@profiling.timed('get_table_totals')
 def get_table_totals(df):
-    total_income = "{:,.2f}".format(round(df[df['Category']=='Income']['Amount'].sum(), 2))
-    total_spending = "{:,.2f}".format(round(df[~df['Category'].isin(['Income','Savings'])]['Amount'].sum(), 2))
-    total_savings = "{:,.2f}".format(round(df[df['Category'].isin(['Savings & Investments'])]['Amount'].sum(), 2))
+    # amounts are summed in cents, so the totals are exact
+    total_income = "{:,.2f}".format(df[df['Category']=='Income']['Amount'].sum() / 100)
+    total_spending = "{:,.2f}".format(df[~df['Category'].isin(['Income','Savings'])]['Amount'].sum() / 100)
+    total_savings = "{:,.2f}".format(df[df['Category'].isin(['Savings & Investments'])]['Amount'].sum() / 100)
+
+    return [total_income, total_spending, total_savings]
+
+def get_table_totals_chunked(csv_file, start_date=None, end_date=None, memory_cap_mb=chunked_summary.MEMORY_CAP_MB):
+    totals = chunked_summary.overall_totals(chunked_summary.summarize(csv_file, start_date, end_date, memory_cap_mb))
+    total_income = "{:,.2f}".format(totals['Income'])
+    total_spending = "{:,.2f}".format(totals['Spent'])
+    total_savings = "{:,.2f}".format(totals['Savings'])
 
     return [total_income, total_spending, total_savings]
 
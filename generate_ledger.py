@@ -0,0 +1,71 @@
+# This file generates synthetic transaction files of any size for testing and benchmarks
+
+# importing libraries
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from data_entry import DATE_FORMAT, CATEGORIES, SUB_CATEGORIES
+
+COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
+CHUNK_ROWS = 1_000_000
+# share of rows in each category, most transactions are spending
+CATEGORY_WEIGHTS = {'I': 0.04, 'S': 0.04, 'E': 0.37, 'N': 0.55}
+# median and spread of the amounts of each category, drawn from a log-normal distribution
+AMOUNT_PARAMS = {'I': (2000, 0.35), 'S': (250, 0.6), 'E': (70, 0.9), 'N': (25, 1.0)}
+MEMOS = ['', 'card', 'online', 'auto pay', 'cash', 'transfer', 'monthly', 'weekend', 'shared', 'refund check']
+
+# returns a chunk of random transactions between two dates, sorted by date
+def generate_chunk(rows, start, end, rng):
+    codes = np.array(list(CATEGORY_WEIGHTS))
+    code = rng.choice(codes, size=rows, p=list(CATEGORY_WEIGHTS.values()))
+
+    sub_category = np.empty(rows, dtype=object)
+    amount = np.empty(rows)
+    for c in codes:
+        rows_of_code = code == c
+        count = int(rows_of_code.sum())
+        sub_category[rows_of_code] = rng.choice(SUB_CATEGORIES[c], size=count)
+        median, sigma = AMOUNT_PARAMS[c]
+        amount[rows_of_code] = rng.lognormal(np.log(median), sigma, size=count)
+
+    # more transactions land on weekends and at the start of the month, like real spending
+    days = pd.date_range(start, end, freq='D')
+    day_weight = np.where(days.dayofweek >= 5, 1.4, 1.0) * np.where(days.day <= 3, 1.5, 1.0)
+    dates = np.sort(rng.choice(days.values, size=rows, p=day_weight / day_weight.sum()))
+
+    return pd.DataFrame({
+        'Date': pd.DatetimeIndex(dates).strftime(DATE_FORMAT),
+        'Category': pd.Series(code).map(CATEGORIES).to_numpy(),
+        'Sub-Category': sub_category,
+        'Memo': rng.choice(MEMOS, size=rows),
+        'Amount': np.maximum(np.round(amount, 2), 0.01)
+    })
+
+# writes a ledger with rows transactions spread over the years before end_date, in chunks
+def write_ledger(csv_file, rows, years=10, end_date=None, seed=0, chunk_rows=CHUNK_ROWS):
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end_date or datetime.today()).normalize()
+    start = end - pd.DateOffset(years=years) + pd.Timedelta(days=1)
+    # each chunk covers its own slice of the date range so the file comes out sorted
+    chunks = max(-(-rows // chunk_rows), 1)
+    bounds = pd.date_range(start, end, periods=chunks + 1).normalize()
+
+    with open(csv_file, 'w', newline='') as file:
+        file.write(','.join(COLUMNS) + '\r\n')
+        for i in range(chunks):
+            chunk_size = min(chunk_rows, rows - i * chunk_rows)
+            chunk_start = bounds[i] if i == 0 else bounds[i] + pd.Timedelta(days=1)
+            chunk = generate_chunk(chunk_size, chunk_start, max(bounds[i + 1], chunk_start), rng)
+            file.write(chunk.to_csv(header=False, index=False, lineterminator='\r\n'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic transactions file')
+    parser.add_argument('rows', type=int, help='number of transactions, e.g. 10000 or 50000000')
+    parser.add_argument('--out', default='transactions.csv')
+    parser.add_argument('--years', type=int, default=10, help='years of history ending today')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_ledger(args.out, args.rows, args.years, seed=args.seed)
+    print(f'Wrote {args.rows} transactions to {args.out}')
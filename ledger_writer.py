@@ -0,0 +1,230 @@
+# This file appends transactions to the csv safely when several processes write at the same time
+
+# importing libraries
+import argparse
+import asyncio
+import csv
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import Process
+import partitions
+import rollup
+
+try:
+    import fcntl
+except ImportError:
+    # windows has no flock, msvcrt locks a byte range of the lock file instead
+    fcntl = None
+    import msvcrt
+
+COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
+MAX_BATCH = 1000
+# how long the writer waits for more entries to share a single write and fsync
+MAX_DELAY = 0.002
+
+# returns the path of the lock file that sits next to a csv file
+def lock_path(csv_file):
+    return csv_file + '.lock'
+
+# holds an exclusive advisory lock on the csv file across processes
+class FileLock:
+    def __init__(self, csv_file:str):
+        self.path = lock_path(csv_file)
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+# returns entries as csv text, with the same line endings as csv.DictWriter
+def entries_to_text(entries, columns=COLUMNS):
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, columns).writerows(entries)
+    return buffer.getvalue()
+
+# appends text to the csv in one write and fsync while holding the lock
+# a partitioned ledger gets each row in the partition of its date instead
+# after_write gets the csv version from before the write and runs under the same lock,
+# so derived files like the rollup are never updated out of order, returns what after_write returns
+def append_text(csv_file, text, after_write=None):
+    with FileLock(csv_file):
+        return append_locked(csv_file, text, after_write)
+
+# appends text like append_text, for a caller that already holds the lock to check the rows before writing them
+def append_locked(csv_file, text, after_write=None):
+    previous_version = rollup.source_version(csv_file)
+    if partitions.is_partitioned(csv_file):
+        partitions.append_text(csv_file, text)
+    else:
+        with open(csv_file, 'a', newline='') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+    if after_write is not None:
+        return after_write(previous_version)
+
+# collects entries from many threads and commits them together, one write and fsync per batch
+class GroupCommitWriter:
+    def __init__(self, csv_file:str, columns:list=COLUMNS, after_write=None, max_batch:int=MAX_BATCH,
+                 max_delay:float=MAX_DELAY, write=None):
+        self.csv_file = csv_file
+        self.columns = columns
+        # called as after_write(entries, previous_version) under the file lock
+        self.after_write = after_write
+        # called as write(entries) instead of appending to csv_file, for transactions kept in a database,
+        # after_write is then called as after_write(entries, None) once it returns
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # queues an entry, the returned future resolves once the entry is on disk
+    def submit(self, entry:dict):
+        future = Future()
+        self.queue.put((entry, future))
+        return future
+
+    # adds an entry and waits until it is on disk
+    def add(self, entry:dict):
+        return self.submit(entry).result()
+
+    # adds many entries and waits until all of them are on disk
+    def add_batch(self, entries:list):
+        for future in [self.submit(entry) for entry in entries]:
+            future.result()
+
+    # adds an entry from async code, resolving once it is on disk
+    async def add_async(self, entry:dict):
+        return await asyncio.wrap_future(self.submit(entry))
+
+    # commits whatever is queued and stops the writer thread
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    # writer thread, takes everything that is queued (up to max_batch) and commits it at once
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            self.commit(batch)
+
+    # writes one batch and resolves its futures
+    # once the rows are on disk the adds have succeeded, a failure updating the derived files only gets reported,
+    # since a caller seeing an error would add the same rows again
+    def commit(self, batch):
+        entries = [entry for entry, _ in batch]
+        after_write = None
+        if self.after_write is not None:
+            after_write = lambda previous_version: self.update_derived(entries, previous_version)
+        try:
+            if self.write is not None:
+                self.write(entries)
+            else:
+                append_text(self.csv_file, entries_to_text(entries, self.columns), after_write)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        if self.write is not None and after_write is not None:
+            after_write(None)
+        for _, future in batch:
+            future.set_result(True)
+
+    # runs after_write for a batch that is on disk, reporting instead of raising if it fails
+    # derived files of a csv that missed the batch no longer match its version, so they are rebuilt when next read
+    def update_derived(self, entries, previous_version):
+        try:
+            return self.after_write(entries, previous_version)
+        except Exception as e:
+            print(f'{len(entries)} transactions were added to {self.csv_file}, but updating its derived files failed: '
+                  f'{e}')
+
+# one producer process of the throughput benchmark, each thread adds its share of entries
+def produce(csv_file, producer, entries, threads, mode):
+    entry = {'Date': '01-15-2024', 'Category': 'Non-Essential', 'Sub-Category': 'Other',
+             'Memo': f'producer {producer}', 'Amount': 1.0}
+    if mode == 'group':
+        writer = GroupCommitWriter(csv_file)
+        add = writer.add
+    else:
+        add = lambda entry: append_text(csv_file, entries_to_text([entry]))
+
+    workers = [threading.Thread(target=lambda: [add(entry) for _ in range(entries // threads)])
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if mode == 'group':
+        writer.close()
+
+# measures how many durable appends per second several producer processes reach
+def measure_throughput(producers=4, entries=2000, threads=8, mode='group'):
+    tmp_dir = tempfile.mkdtemp()
+    csv_file = os.path.join(tmp_dir, 'transactions.csv')
+    with open(csv_file, 'w', newline='') as file:
+        csv.writer(file).writerow(COLUMNS)
+    try:
+        start = time.perf_counter()
+        processes = [Process(target=produce, args=(csv_file, producer, entries, threads, mode))
+                     for producer in range(producers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        # every row has to come back whole, interleaved or torn rows would break this
+        with open(csv_file, newline='') as file:
+            rows = list(csv.reader(file))[1:]
+        expected = producers * (entries // threads) * threads
+        intact = len(rows) == expected and all(len(row) == len(COLUMNS) for row in rows)
+        return {'mode': mode, 'rows': len(rows), 'seconds': elapsed, 'rows_per_second': len(rows) / elapsed,
+                'intact': intact}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure append throughput with several concurrent producers')
+    parser.add_argument('--producers', type=int, default=4, help='number of processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads in each process')
+    parser.add_argument('--entries', type=int, default=2000, help='entries added by each process')
+    args = parser.parse_args()
+
+    for mode in ('single', 'group'):
+        result = measure_throughput(args.producers, args.entries, args.threads, mode)
+        print(f"{mode:>6}: {result['rows']} rows in {result['seconds']:.2f}s "
+              f"({result['rows_per_second']:,.0f} rows/s), intact: {result['intact']}")
@@ -1,26 +1,60 @@
 # This file runs the main aspect of the program
 
 # importing libraries
+# pandas, pyarrow and the plotting libraries are imported inside the methods that use them,
+# so the menu and adding a transaction start without loading them
+import argparse
+import budgets
+import chart_cache
 import csv
-from data_entry import get_date, get_category, get_sub_cat, get_memo, get_amount
-import data_visuals
+from datetime import datetime
+from data_entry import get_date, get_category, get_sub_cat, get_memo, get_amount, check_entry
+import duplicates
+import ledger_writer
+import memo_index
 import os
-import pandas as pd
+import partitions
+import profiling
+import sys
+import threading
+import rollup
 
 # creating a csv class to house the file methods
 class CSV:
     CSV_file = 'transactions.csv'
     COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
     DATE_FORMAT = "%m-%d-%Y"
+    # set to a number of megabytes to summarize the file in chunks instead of loading it all
+    MEMORY_CAP_MB = None
+    # 'csv' keeps transactions in CSV_file, 'sqlite' keeps them in DB_file
+    BACKEND = os.environ.get('FINANCE_TRACKER_BACKEND', 'csv')
+    DB_file = 'transactions.db'
+    # 'flag' adds a transaction that matches one already in the ledger with a warning, 'reject' leaves it out
+    DUPLICATES = os.environ.get('FINANCE_TRACKER_DUPLICATES', 'flag')
+    # 'month' or 'year' splits CSV_file into time partitions, a single-file ledger is moved into them on start,
+    # 'none' keeps it in one file
+    PARTITIONS = partitions.GRANULARITY
+    group_writer = None
+
+    # returns the sqlite backend when it is selected, None when the csv file is used
+    @classmethod
+    def get_backend(cls):
+        if cls.BACKEND == 'sqlite':
+            from sqlite_backend import SQLiteBackend
+            return SQLiteBackend(cls.DB_file, cls.DATE_FORMAT)
+        return None
 
     # initialize csv file if none is created in present directory
     @classmethod
     def initialize_csv(cls):
-        try:
-            pd.read_csv(cls.CSV_file)
-        except FileNotFoundError:
-            df = pd.DataFrame(columns=cls.COLUMNS)
-            df.to_csv(cls.CSV_file, index=False)
+        backend = cls.get_backend()
+        if backend is not None:
+            backend.connect().close()
+        elif cls.PARTITIONS != 'none' or partitions.is_partitioned(cls.CSV_file):
+            partitions.initialize(cls.CSV_file, cls.PARTITIONS, cls.DATE_FORMAT)
+        elif not os.path.exists(cls.CSV_file):
+            with open(cls.CSV_file, 'w', newline='') as file:
+                csv.writer(file).writerow(cls.COLUMNS)
 
     # adds a new transaction to the end of the file
     @classmethod
@@ -32,42 +66,271 @@ class CSV:
             'Memo': memo,
             'Amount': amount
         }
-        with open(cls.CSV_file, 'a', newline='') as file:
-            writer = csv.DictWriter(file, cls.COLUMNS)
-            writer.writerow(new_entry)
+        added, messages = cls.add_entries([new_entry])
+
+        if added:
+            print('Transaction added successfully')
+        for message in messages:
+            print(message)
+
+    # adds many transactions with a single write, or a single database transaction
+    # returns how many were added, and the duplicate warnings and budget alerts they set off
+    @classmethod
+    @profiling.timed('add_entries')
+    def add_entries(cls, entries:list):
+        backend = cls.get_backend()
+        source = cls.DB_file if backend is not None else cls.CSV_file
+        # the lookup and the write hold the lock together, so two adds of the same row can't both pass the check
+        with ledger_writer.FileLock(source):
+            return cls.add_entries_locked(backend, source, entries)
 
-        print('Transaction added successfully')
+    # checks entries against the key index and adds the ones that are kept, runs under the ledger's file lock
+    @classmethod
+    def add_entries_locked(cls, backend, source:str, entries:list):
+        # each entry is looked up in the key index, not compared against every transaction
+        found = duplicates.find_duplicates(source, duplicates.entry_keys(entries, cls.DATE_FORMAT),
+                                           cls.DATE_FORMAT, backend)
+        messages = [f"Possible duplicate of a transaction already in the ledger: {entry['Date']} "
+                    f"{entry['Sub-Category']} ${float(entry['Amount']):.2f} {entry['Memo']!r}"
+                    + (' was not added' if cls.DUPLICATES == 'reject' else '')
+                    for entry, duplicate in zip(entries, found) if duplicate]
+        if cls.DUPLICATES == 'reject':
+            entries = [entry for entry, duplicate in zip(entries, found) if not duplicate]
+        if not entries:
+            return 0, messages
+
+        if backend is not None:
+            return len(entries), messages + cls.add_to_backend(backend, entries)
+
+        # the lock keeps rows of concurrent writers from interleaving, fsync makes them durable
+        return len(entries), messages + ledger_writer.append_locked(
+            cls.CSV_file, ledger_writer.entries_to_text(entries, cls.COLUMNS),
+            lambda previous_version: cls.update_derived(entries, previous_version))
+
+    # inserts entries into the sqlite backend and updates its key index, budget counters and cached charts
+    # returns the budget alerts the entries set off
+    @classmethod
+    def add_to_backend(cls, backend, entries:list):
+        backend.add_entries(entries)
+        return cls.update_backend_derived(backend, entries)
+
+    # updates the key index, budget counters and cached charts of the sqlite backend for newly inserted entries
+    @classmethod
+    def update_backend_derived(cls, backend, entries:list):
+        duplicates.add_keys(cls.DB_file, duplicates.entry_keys(entries, cls.DATE_FORMAT), backend=backend)
+        chart_cache.invalidate(cls.DB_file, sorted({datetime.strptime(entry['Date'], cls.DATE_FORMAT)
+                                                    .strftime(rollup.MONTH_FORMAT) for entry in entries}))
+        return budgets.record_spending(cls.DB_file, budgets.entry_totals(entries, cls.DATE_FORMAT),
+                                       date_format=cls.DATE_FORMAT, backend=backend)
+
+    # updates the rollup, key and memo indexes, budget counters and cached charts for newly appended entries,
+    # runs under the file lock, returns the budget alerts the entries set off
+    @classmethod
+    def update_derived(cls, entries:list, previous_version:list):
+        rollup.add_to_rollup(cls.CSV_file, entries, previous_version, cls.DATE_FORMAT)
+        duplicates.add_keys(cls.CSV_file, duplicates.entry_keys(entries, cls.DATE_FORMAT), previous_version,
+                            cls.DATE_FORMAT)
+        memo_index.add_memos(cls.CSV_file, [entry['Memo'] for entry in entries], previous_version)
+        chart_cache.invalidate(cls.CSV_file, sorted({datetime.strptime(entry['Date'], cls.DATE_FORMAT)
+                                                     .strftime(rollup.MONTH_FORMAT) for entry in entries}))
+        return budgets.record_spending(cls.CSV_file, budgets.entry_totals(entries, cls.DATE_FORMAT),
+                                       previous_version, cls.DATE_FORMAT)
+
+    # returns the shared writer that group commits entries added from many threads
+    # writer().add(entry) returns once the entry is on disk, writer().add_async(entry) does the same for async code
+    @classmethod
+    def writer(cls):
+        if cls.group_writer is None:
+            backend = cls.get_backend()
+            if backend is not None:
+                # each batch is one database transaction instead of one write to the csv
+                cls.group_writer = ledger_writer.GroupCommitWriter(
+                    cls.DB_file, cls.COLUMNS, lambda entries, _: cls.update_backend_derived(backend, entries),
+                    write=backend.add_entries)
+            else:
+                cls.group_writer = ledger_writer.GroupCommitWriter(cls.CSV_file, cls.COLUMNS, cls.update_derived)
+        return cls.group_writer
+
+    # imports a bank or card statement file in chunks, returns the number of imported and rejected rows
+    @classmethod
+    def import_statement(cls, statement_file:str, column_map:dict=None):
+        import bulk_import
+        backend = cls.get_backend()
+        if backend is not None:
+            return bulk_import.import_statement(statement_file, cls.DB_file, column_map, date_format=cls.DATE_FORMAT,
+                                                backend=backend)
+        return bulk_import.import_statement(statement_file, cls.CSV_file, column_map, date_format=cls.DATE_FORMAT)
+
+    # returns the typed transactions from the columnar store, optionally only some columns
+    # amounts are integer cents and categories are codes, storage.to_display turns them back into dollars
+    # filters use the same names as functions.filter_transaction_dataframe and are applied while loading
+    @classmethod
+    def load_transactions(cls, columns:list=None, filters:dict=None):
+        import storage
+        backend = cls.get_backend()
+        if backend is not None:
+            return backend.load_transactions(columns, filters)
+        if filters:
+            return storage.query_ledger(cls.CSV_file, filters, columns=columns, date_format=cls.DATE_FORMAT)
+        return storage.load_ledger(cls.CSV_file, columns=columns, date_format=cls.DATE_FORMAT)
+
+    # replaces the ledger with the transactions of a csv file in the ledger layout
+    @classmethod
+    def import_csv(cls, csv_file:str):
+        import storage
+        df = storage.read_ledger_csv(csv_file, cls.DATE_FORMAT)
+        backend = cls.get_backend()
+        if backend is not None:
+            # the key index and budget counters of the database aren't versioned, so they are rebuilt
+            backend.add_entries(storage.to_ledger_csv(df, cls.DATE_FORMAT).to_dict('records'), replace=True)
+            duplicates.rebuild(cls.DB_file, cls.DATE_FORMAT, backend)
+            budgets.recompute(cls.DB_file, cls.DATE_FORMAT, backend)
+            return
+        if partitions.is_partitioned(cls.CSV_file):
+            partitions.replace(cls.CSV_file, storage.to_ledger_csv(df, cls.DATE_FORMAT))
+            return
+        storage.to_ledger_csv(df, cls.DATE_FORMAT).to_csv(cls.CSV_file, index=False)
+        storage.write_store(df, storage.store_path(cls.CSV_file), cls.CSV_file)
+
+    # writes every transaction out to a single csv file in the ledger layout
+    @classmethod
+    def export_csv(cls, csv_file:str):
+        import storage
+        storage.to_ledger_csv(cls.load_transactions(), cls.DATE_FORMAT).to_csv(csv_file, index=False)
 
     # returns a summary of user transactions in the terminal
     @classmethod
+    @profiling.timed('get_summary')
     def get_summary(cls, start_date:str, end_date:str):
-        df = pd.read_csv(cls.CSV_file)
-
-        df['Date'] = pd.to_datetime(df['Date'], format=cls.DATE_FORMAT)
-        transaction_period = df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
-        if transaction_period.empty:
+        import pandas as pd
+        import chunked_summary
+        import storage
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        backend = cls.get_backend()
+        if backend is not None or not cls.MEMORY_CAP_MB:
+            # totals per category come from an indexed sql query or the monthly rollup, not every transaction
+            if backend is not None:
+                category_totals = backend.range_totals(start, end)
+            else:
+                category_totals = rollup.range_totals(cls.CSV_file, start, end, cls.DATE_FORMAT)
+            # amounts are added up in cents and shown in dollars
+            totals = rollup.summary_totals(category_totals)
+        else:
+            # ledgers bigger than memory are streamed in chunks
+            totals = chunked_summary.overall_totals(
+                chunked_summary.summarize(cls.CSV_file, start, end, cls.MEMORY_CAP_MB, cls.DATE_FORMAT))
+        if totals['Count'] == 0:
             print(f"\nThere are no transactions between {start_date} and {end_date}\n")
         else:
             print()
-            print(f"Total Income: ${transaction_period[transaction_period['Category']=='Income']['Amount'].sum()}")     
-            print(f"Total Spent: ${transaction_period[~transaction_period['Category'].isin(['Income','Savings'])]['Amount'].sum()}")   
-            print(f"Total Savings: ${transaction_period[transaction_period['Category'].isin(['Savings & Investments'])]['Amount'].sum()}")
+            print(f"Total Income: ${totals['Income']}")     
+            print(f"Total Spent: ${totals['Spent']}")   
+            print(f"Total Savings: ${totals['Savings']}")
 
             if input('\nWould you like to view the dataset? (y/n) ').lower().startswith('y'):
                 print()
-                print(transaction_period)
+                print(storage.to_display(cls.load_transactions(filters={'Start Date': start, 'End Date': end})))
     
     # returns desired visualizations
     @classmethod
+    @profiling.timed('get_visuals')
     def get_visuals(cls):
-        data_visuals.main(cls.CSV_file)
+        import data_visuals
+        data_visuals.main(cls.CSV_file, cls.get_backend())
+
+    # loads what the summary and charts read, so they find it ready instead of parsing the file
+    # the menu runs this in the background at startup and after each added transaction
+    @classmethod
+    def prepare(cls):
+        import chart_data
+        import data_visuals
+        backend = cls.get_backend()
+        # a ledger summarized in chunks may not fit in memory, so only its rollup is prepared,
+        # and a partitioned one is read by the partitions each date range needs
+        if backend is None and not cls.MEMORY_CAP_MB and not partitions.is_partitioned(cls.CSV_file):
+            import storage
+            storage.load_ledger(cls.CSV_file, date_format=cls.DATE_FORMAT)
+        chart_data.load_monthly_totals(cls.CSV_file, cls.DATE_FORMAT, backend)
+
+    # saves the rows read this session to the columnar store, so the next session doesn't parse them again
+    @classmethod
+    def save_store(cls):
+        if cls.get_backend() is None:
+            import storage
+            storage.save_store(cls.CSV_file)
+
+    # copies the csv ledger into the sqlite database, which must be empty
+    @classmethod
+    def migrate_to_sqlite(cls):
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend(cls.DB_file, cls.DATE_FORMAT).migrate_from_csv(cls.CSV_file)
 
             
+# runs a function in a background thread while the menu waits for input
+class Prefetcher:
+    def __init__(self, prepare):
+        self.prepare = prepare
+        self.thread = None
+        self.error = None
+
+    # starts preparing again, once a run that is still going has finished
+    def start(self):
+        self.wait()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.prepare()
+            self.error = None
+        except Exception as e:
+            # the option that needs the data loads it again itself and reports the error there
+            self.error = e
+
+    # blocks until the data is ready, returns False if preparing it failed
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        return self.error is None
+
 
+# adds one transaction from the command line without any prompts
+def add_command(argv):
+    parser = argparse.ArgumentParser(prog='main.py add', description='Add a transaction without the menu')
+    parser.add_argument('--date', help="transaction date (mm-dd-yyyy), defaults to today's date")
+    parser.add_argument('--category', required=True, help='category code or name')
+    parser.add_argument('--sub-category', required=True)
+    parser.add_argument('--memo', default='')
+    parser.add_argument('--amount', required=True, type=float)
+    args = parser.parse_args(argv)
+
+    date = args.date or datetime.today().strftime(CSV.DATE_FORMAT)
+    try:
+        category = check_entry(date, args.category, args.sub_category, args.memo, args.amount, CSV.DATE_FORMAT)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    CSV.initialize_csv()
+    CSV.add_entry(date=date, category=category, sub_category=args.sub_category, memo=args.memo, amount=args.amount)
 
 if __name__ == "__main__":
+    # python main.py --profile writes a trace of every stage, like FINANCE_TRACKER_PROFILE=1
+    if '--profile' in sys.argv:
+        sys.argv.remove('--profile')
+        profiling.enable(profiling.trace_file)
+        print(f'Profiling to {profiling.trace_file}')
+
+    # python main.py add ... appends one transaction and exits
+    if len(sys.argv) > 1 and sys.argv[1] == 'add':
+        add_command(sys.argv[2:])
+        sys.exit()
+
     # make sure there is a transaction csv to get data from
     CSV.initialize_csv()
+    # the ledger is loaded in the background while the user picks an option
+    prefetcher = Prefetcher(CSV.prepare)
+    prefetcher.start()
 
     while True:
         print(f'\n{"*" * 20} Choose an option {"*" * 20}')
@@ -89,7 +352,11 @@ if __name__ == "__main__":
                 memo = get_memo()
                 amount = get_amount()
 
+                # the rollup is written by both, so the add waits for a load that is still running
+                prefetcher.wait()
                 CSV.add_entry(date=date, category=category, sub_category=sub_cat, memo=memo, amount=amount)
+                # only the new rows are read, the rest of the ledger is still in memory
+                prefetcher.start()
 
             # user chooses to view a summary between to dates
             elif choice == 2:
@@ -99,15 +366,19 @@ if __name__ == "__main__":
                 start_date = input('Start Date: ')
                 end_date = input('End Date: ')
 
+                prefetcher.wait()
                 CSV.get_summary(start_date=start_date,end_date=end_date)
 
             # user chooses to look at some visualizations
             elif choice == 3:
+                prefetcher.wait()
                 CSV.get_visuals()
 
             # user chooses to exit the program
             elif choice == 4:
                 print('\nYou chose to exit')
+                prefetcher.wait()
+                CSV.save_store()
                 break
             
             # user must choose one of the 4 options
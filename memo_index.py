@@ -0,0 +1,176 @@
+# This file keeps an inverted index of the words in memos next to the ledger, so memo searches don't scan every row
+# each word maps to the positions of the rows that use it, in the order the rows are in the csv file
+# a partitioned ledger has an index per partition, so an append only touches the index of the partition it lands in
+
+# importing libraries
+# numpy and pandas are only imported to build the index or turn matches into a row mask,
+# adding the words of new rows from CSV.add_entry only needs sqlite3
+import argparse
+import re
+import sqlite3
+from data_entry import DATE_FORMAT
+import ledger_writer
+import partitions
+import rollup
+
+TOKEN = re.compile(r'[a-z0-9]+')
+# operators of the memo filters in storage.FILTER_PREDICATES
+MEMO_OPERATORS = ('keywords', 'prefix')
+# the most rows looked up in one query, below sqlite's limit on parameters
+LOOKUP_BATCH = 500
+# after this few matching rows, the remaining words are only looked up among them
+NARROW_ROWS = 5000
+
+# returns the path of the memo index that sits next to a csv file
+def index_path(csv_file):
+    return partitions.stem(csv_file) + '_memos.db'
+
+# returns the words of a memo, in lower case without punctuation
+def tokenize(memo:str):
+    return TOKEN.findall(memo.lower())
+
+# opens the index, creating its tables the first time
+def connect(csv_file):
+    conn = sqlite3.connect(index_path(csv_file))
+    # rows are clustered by word, so a word or a prefix of one is a single range read
+    conn.execute('CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, row INTEGER NOT NULL, '
+                 'PRIMARY KEY (token, row)) WITHOUT ROWID')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+    return conn
+
+# returns a value saved in the meta table
+def get_meta(conn, name):
+    row = conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+# saves the csv version the index matches and how many rows it covers
+def set_meta(conn, version, rows):
+    conn.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                     [('source', str(version)), ('rows', str(rows))])
+
+# rebuilds the index from every memo in the ledger, or the index of every partition of a partitioned ledger
+def rebuild(csv_file, date_format=DATE_FORMAT):
+    import storage
+    if partitions.is_partitioned(csv_file):
+        return sum(rebuild(path, date_format) for path in partitions.partition_files(csv_file))
+    # the version is taken before reading, so rows appended meanwhile leave the index stale instead of missing them
+    version = rollup.source_version(csv_file)
+    memos = storage.load_ledger(csv_file, columns=['Memo'], date_format=date_format)['Memo']
+    postings = (memos.astype(str).str.lower().str.findall(TOKEN.pattern)
+                     .explode().dropna().reset_index().drop_duplicates())
+
+    conn = connect(csv_file)
+    try:
+        with conn:
+            conn.execute('DELETE FROM postings')
+            conn.executemany('INSERT INTO postings (token, row) VALUES (?, ?)',
+                             zip(postings['Memo'].tolist(), postings['index'].tolist()))
+            set_meta(conn, version, len(memos))
+    finally:
+        conn.close()
+    return len(memos)
+
+# rebuilds the index if the csv changed since it was last updated, holding the lock so no rows land meanwhile
+def ensure_current(csv_file, date_format=DATE_FORMAT):
+    conn = connect(csv_file)
+    try:
+        version = get_meta(conn, 'source')
+    finally:
+        conn.close()
+    if version != str(rollup.source_version(csv_file)):
+        with ledger_writer.FileLock(csv_file):
+            rebuild(csv_file, date_format)
+
+# adds the words of newly appended memos, runs under the ledger's file lock
+# previous_version is the csv version before the append, a stale index is left to be rebuilt by the next search
+# the rows of a partitioned ledger are added to the index of their partition by partitions.append_text instead
+def add_memos(csv_file, memos, previous_version):
+    if partitions.is_partitioned(csv_file):
+        return
+    conn = connect(csv_file)
+    try:
+        if get_meta(conn, 'source') != str(previous_version):
+            return
+        start = int(get_meta(conn, 'rows'))
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO postings (token, row) VALUES (?, ?)',
+                             [(token, start + i) for i, memo in enumerate(memos) for token in tokenize(memo or '')])
+            set_meta(conn, rollup.source_version(csv_file), start + len(memos))
+    finally:
+        conn.close()
+
+# returns the rows whose memos have a word, or a word starting with a prefix
+# candidates limits the lookup to rows already matched by other words, so a common word doesn't read its whole list
+def rows_with(conn, token, prefix=False, candidates=None):
+    import numpy as np
+    if prefix:
+        # every word starting with the prefix sorts between it and the prefix followed by the last character
+        condition, params = 'token >= ? AND token < ?', [token, token + '\U0010ffff']
+    else:
+        condition, params = 'token = ?', [token]
+    if candidates is None:
+        rows = conn.execute(f'SELECT row FROM postings WHERE {condition}', params).fetchall()
+    else:
+        rows = []
+        for i in range(0, len(candidates), LOOKUP_BATCH):
+            batch = candidates[i:i + LOOKUP_BATCH].tolist()
+            rows += conn.execute(f"SELECT row FROM postings WHERE {condition} AND row IN ({', '.join('?' * len(batch))})",
+                                 params + batch).fetchall()
+    return np.unique(np.fromiter((row for row, in rows), dtype=np.int64, count=len(rows)))
+
+# returns a mask over the rows of the ledger, in file order, of the memos matching every memo predicate
+# 'keywords' needs each word of its value, 'prefix' needs a word starting with its value
+def row_mask(csv_file, predicates, rows:int, date_format=DATE_FORMAT):
+    import numpy as np
+    if partitions.is_partitioned(csv_file):
+        import storage
+        # the rows of a partitioned ledger are its partitions one after the other
+        masks = [row_mask(path, predicates, len(df), date_format)
+                 for path, df in storage.partition_frames(csv_file, date_format)]
+        mask = np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+        return np.concatenate([mask, np.zeros(max(rows - len(mask), 0), dtype=bool)])[:rows]
+    ensure_current(csv_file, date_format)
+    lookups = [(token, operator == 'prefix') for column, operator, value in predicates
+               for word in ([value] if isinstance(value, str) else value) for token in tokenize(word)]
+    # longer words are usually rarer, so they are looked up first and the rest only among their rows
+    lookups.sort(key=lambda lookup: -len(lookup[0]))
+    found = None
+    conn = connect(csv_file)
+    try:
+        for token, prefix in lookups:
+            narrow = found is not None and len(found) <= NARROW_ROWS
+            found_now = rows_with(conn, token, prefix, found if narrow else None)
+            found = found_now if found is None else np.intersect1d(found, found_now, assume_unique=True)
+    finally:
+        conn.close()
+    if found is None:
+        return np.ones(rows, dtype=bool)
+    mask = np.zeros(rows, dtype=bool)
+    mask[found[found < rows]] = True
+    return mask
+
+# returns a mask of the memos matching the memo predicates by scanning them, for frames the index doesn't cover
+def scan_mask(memos, predicates):
+    import numpy as np
+    memos = memos.astype(str).str.lower()
+    mask = np.ones(len(memos), dtype=bool)
+    for column, operator, value in predicates:
+        for word in [token for word in ([value] if isinstance(value, str) else value) for token in tokenize(word)]:
+            end = '' if operator == 'prefix' else '(?:[^a-z0-9]|$)'
+            mask &= memos.str.contains(f'(?:^|[^a-z0-9]){word}{end}', regex=True).to_numpy()
+    return mask
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or search the memo index of a ledger')
+    parser.add_argument('command', choices=['rebuild', 'search'])
+    parser.add_argument('words', nargs='*', help='words every memo must have, for search')
+    parser.add_argument('--prefix', help='a word of the memo must start with this, for search')
+    parser.add_argument('--ledger', default='transactions.csv')
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        print(f'Indexed the memos of {rebuild(args.ledger)} transactions in {index_path(args.ledger)}')
+    else:
+        import storage
+        filters = {'Keywords': args.words, 'Memo Prefix': args.prefix}
+        print(storage.to_display(storage.query_ledger(args.ledger, filters)).to_string())
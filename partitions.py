@@ -0,0 +1,302 @@
+# This file splits the ledger into time partitions, so a query for a date range only opens the files it covers
+# a partitioned transactions.csv lives in transactions_partitions/, with a file per month (or year) of the current
+# year that rows are appended to, and a gzip file per closed year, e.g. 2019.csv.gz, 2024-01.csv, 2024-02.csv
+# every partition is a csv in the ledger layout, so storage reads each one like a small single-file ledger
+
+# importing libraries
+# pandas is only imported to migrate or compact, so routing appended rows stays cheap
+import argparse
+import calendar
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+from datetime import date, datetime
+from data_entry import DATE_FORMAT
+
+COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
+# 'month' or 'year' partitions for the current year, 'none' keeps the ledger in a single file
+GRANULARITIES = ['month', 'year', 'none']
+GRANULARITY = os.environ.get('FINANCE_TRACKER_PARTITIONS', 'month')
+LAYOUT_FILE = 'partitions.json'
+PARTITION_NAME = re.compile(r'^(\d{4})(?:-(\d{2}))?\.csv(\.gz)?$')
+# closed years are compressed with a moderate level, most of the size is saved and writing stays quick
+COMPRESSION = {'method': 'gzip', 'compresslevel': 6, 'mtime': 0}
+
+# returns the directory that holds the partitions of a ledger
+def partition_dir(ledger_file):
+    return os.path.splitext(ledger_file)[0] + '_partitions'
+
+# checks if a ledger has been split into partitions
+def is_partitioned(ledger_file):
+    return os.path.isdir(partition_dir(ledger_file))
+
+# checks if a partition is a compressed closed year
+def is_compressed(path):
+    return path.endswith('.gz')
+
+# returns a path without its .csv or .csv.gz extension, derived files of a partition are named after it
+def stem(path):
+    return os.path.splitext(path[:-3] if is_compressed(path) else path)[0]
+
+# reads the granularity and date format the partitions were made with
+def read_layout(ledger_file):
+    with open(os.path.join(partition_dir(ledger_file), LAYOUT_FILE)) as file:
+        return json.load(file)
+
+# returns the first and last day a partition file covers, None for files that aren't partitions
+def partition_range(name):
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    year, month = int(match.group(1)), match.group(2)
+    if month is None:
+        return date(year, 1, 1), date(year, 12, 31)
+    month = int(month)
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+# returns a date or datetime-like value as a date
+def as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+# returns the partition files of a ledger that overlap a date range, oldest first
+def partition_files(ledger_file, start=None, end=None):
+    directory = partition_dir(ledger_file)
+    start, end = as_date(start), as_date(end)
+    found = []
+    for name in os.listdir(directory):
+        covered = partition_range(name)
+        if covered is None:
+            continue
+        if (start is None or covered[1] >= start) and (end is None or covered[0] <= end):
+            found.append((covered, name))
+    return [os.path.join(directory, name) for covered, name in sorted(found)]
+
+# returns the files holding a ledger's rows in a date range, the ledger itself when it isn't partitioned
+def ledger_files(ledger_file, start=None, end=None):
+    return partition_files(ledger_file, start, end) if is_partitioned(ledger_file) else [ledger_file]
+
+# returns the size and modified time of a single partition, like rollup.source_version gives for a csv
+def file_version(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# returns the total size and latest modified time of the partitions, which changes with every append
+def version(ledger_file):
+    stats = [os.stat(path) for path in partition_files(ledger_file)]
+    return [sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)]
+
+# returns what identifies a version of the partitions, in the form storage.file_signature has
+def signature(ledger_file):
+    size, mtime_ns = version(ledger_file)
+    return {'identity': (os.path.abspath(partition_dir(ledger_file)), len(partition_files(ledger_file))),
+            'size': size, 'mtime_ns': mtime_ns}
+
+# returns the file a row dated on a day goes to
+# a closed year that was compacted takes it in its gzip file, otherwise it goes to its month or year
+def partition_for(ledger_file, day, granularity):
+    directory = partition_dir(ledger_file)
+    closed_year = os.path.join(directory, f'{day.year}.csv.gz')
+    if os.path.exists(closed_year):
+        return closed_year
+    name = f'{day.year}-{day.month:02d}.csv' if granularity == 'month' else f'{day.year}.csv'
+    return os.path.join(directory, name)
+
+# appends rows to a partition and syncs them to disk, a new plain partition starts with the header
+# rows added to a closed year become another gzip member, which readers see as part of the same file
+def write_rows(path, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    if not os.path.exists(path) and not is_compressed(path):
+        writer.writerow(COLUMNS)
+    writer.writerows(rows)
+    with open(path, 'ab') as file:
+        if is_compressed(path):
+            with gzip.GzipFile(fileobj=file, mode='ab', mtime=0) as member:
+                member.write(buffer.getvalue().encode())
+        else:
+            file.write(buffer.getvalue().encode())
+        file.flush()
+        os.fsync(file.fileno())
+
+# appends csv rows to the partitions of their dates, runs under the ledger's file lock
+# each partition's memo index gets the memos of its new rows, it is checked against the partition's own version
+def append_text(ledger_file, text):
+    import memo_index
+    layout = read_layout(ledger_file)
+    routed = {}
+    for row in csv.reader(io.StringIO(text)):
+        if row:
+            day = datetime.strptime(row[0], layout['date_format'])
+            routed.setdefault(partition_for(ledger_file, day, layout['granularity']), []).append(row)
+    for path, rows in routed.items():
+        # a new partition has no index yet, the first search builds it
+        previous_version = file_version(path) if os.path.exists(path) else None
+        write_rows(path, rows)
+        if previous_version is not None:
+            memo_index.add_memos(path, [row[3] for row in rows], previous_version)
+
+# writes string rows in the ledger layout into a new partition directory
+# rows of closed years go to one gzip file per year, rows of the current year to a file per month or year
+def write_partitions(directory, rows, granularity, date_format=DATE_FORMAT):
+    import pandas as pd
+    os.makedirs(directory)
+    with open(os.path.join(directory, LAYOUT_FILE), 'w') as file:
+        json.dump({'granularity': granularity, 'date_format': date_format}, file)
+    dates = pd.to_datetime(rows['Date'], format=date_format)
+    current_year = date.today().year
+    open_names = (dates.dt.strftime('%Y-%m') if granularity == 'month' else dates.dt.year.astype(str)) + '.csv'
+    names = open_names.where(dates.dt.year >= current_year, dates.dt.year.astype(str) + '.csv.gz')
+    # rows keep their order within a partition, compact sorts them
+    for name, part in rows.groupby(names, sort=False):
+        part.to_csv(os.path.join(directory, name), index=False, lineterminator='\r\n',
+                    compression=COMPRESSION if is_compressed(name) else None)
+
+# removes the files storage and the memo index keep next to a partition
+def remove_derived(path):
+    for derived in (stem(path) + '.feather', stem(path) + '_memos.db', path + '.lock'):
+        if os.path.exists(derived):
+            os.remove(derived)
+
+# keeps the rollup, key index and budget counters valid across a rewrite that moved rows but changed none
+# they are compared against the ledger version, so the ones that matched the old layout get the new version
+def carry_over(ledger_file, old_version):
+    import budgets
+    import duplicates
+    import rollup
+    totals = rollup.read_rollup(ledger_file)
+    if totals is not None and totals['source'] == old_version:
+        rollup.write_rollup(ledger_file, totals['totals'])
+    if os.path.exists(duplicates.index_path(ledger_file)):
+        conn = duplicates.connect(ledger_file)
+        try:
+            if duplicates.indexed_version(conn) == str(old_version):
+                with conn:
+                    duplicates.set_version(conn, ledger_file)
+        finally:
+            conn.close()
+    counters = budgets.read_spending(ledger_file)
+    if counters is not None and counters['source'] == old_version:
+        budgets.write_json(budgets.spending_path(ledger_file),
+                           dict(counters, source=rollup.source_version(ledger_file)))
+
+# splits a single-file ledger into partitions, keeping the original next to it as <ledger>.migrated
+# returns the number of partitions written
+def migrate(ledger_file, granularity=GRANULARITY, date_format=DATE_FORMAT):
+    import pandas as pd
+    import ledger_writer
+    import memo_index
+    import rollup
+    import storage
+    if granularity not in GRANULARITIES[:2]:
+        raise ValueError(f'Invalid granularity {granularity!r}. Use one of: {", ".join(GRANULARITIES[:2])}')
+    directory = partition_dir(ledger_file)
+    with ledger_writer.FileLock(ledger_file):
+        if is_partitioned(ledger_file):
+            return len(partition_files(ledger_file))
+        old_version = rollup.source_version(ledger_file)
+        rows = pd.read_csv(ledger_file, dtype=str, keep_default_na=False)
+        # written next to the final directory and renamed, so a crash never leaves half a layout in use
+        shutil.rmtree(directory + '.tmp', ignore_errors=True)
+        write_partitions(directory + '.tmp', rows, granularity, date_format)
+        os.replace(directory + '.tmp', directory)
+        os.replace(ledger_file, ledger_file + '.migrated')
+        # the store and memo index of the single file are replaced by ones per partition
+        for derived in (storage.store_path(ledger_file), memo_index.index_path(ledger_file)):
+            if os.path.exists(derived):
+                os.remove(derived)
+        carry_over(ledger_file, old_version)
+    return len(partition_files(ledger_file))
+
+# creates an empty ledger, or partitions a single-file one, unless partitioning is off
+def initialize(ledger_file, granularity=GRANULARITY, date_format=DATE_FORMAT):
+    if is_partitioned(ledger_file):
+        return
+    if granularity == 'none':
+        if not os.path.exists(ledger_file):
+            with open(ledger_file, 'w', newline='') as file:
+                csv.writer(file).writerow(COLUMNS)
+    elif os.path.exists(ledger_file):
+        migrate(ledger_file, granularity, date_format)
+    else:
+        os.makedirs(partition_dir(ledger_file))
+        with open(os.path.join(partition_dir(ledger_file), LAYOUT_FILE), 'w') as file:
+            json.dump({'granularity': granularity, 'date_format': date_format}, file)
+
+# replaces every transaction of a partitioned ledger with string rows in the ledger layout
+def replace(ledger_file, rows):
+    import ledger_writer
+    layout = read_layout(ledger_file)
+    directory = partition_dir(ledger_file)
+    with ledger_writer.FileLock(ledger_file):
+        shutil.rmtree(directory + '.tmp', ignore_errors=True)
+        write_partitions(directory + '.tmp', rows, layout['granularity'], layout['date_format'])
+        shutil.rmtree(directory + '.old', ignore_errors=True)
+        os.replace(directory, directory + '.old')
+        os.replace(directory + '.tmp', directory)
+        shutil.rmtree(directory + '.old')
+
+# rewrites partitions: closed years become a single gzip file sorted by date,
+# and with rewrite_all every other partition is sorted and rewritten as well (merging extra gzip members)
+# returns the names of the partitions written
+def compact(ledger_file, rewrite_all=False):
+    import pandas as pd
+    import ledger_writer
+    import rollup
+    layout = read_layout(ledger_file)
+    directory = partition_dir(ledger_file)
+    current_year = date.today().year
+    written = []
+    with ledger_writer.FileLock(ledger_file):
+        old_version = rollup.source_version(ledger_file)
+        years = {}
+        for path in partition_files(ledger_file):
+            years.setdefault(partition_range(os.path.basename(path))[0].year, []).append(path)
+
+        for year, paths in sorted(years.items()):
+            closed = year < current_year
+            if closed and (rewrite_all or any(not is_compressed(path) for path in paths)):
+                groups = [(os.path.join(directory, f'{year}.csv.gz'), paths)]
+            elif rewrite_all:
+                groups = [(path, [path]) for path in paths]
+            else:
+                continue
+            for target, sources in groups:
+                rows = pd.concat([pd.read_csv(path, dtype=str, keep_default_na=False) for path in sources],
+                                 ignore_index=True)
+                order = pd.to_datetime(rows['Date'], format=layout['date_format']).argsort(kind='stable')
+                rows.iloc[order].to_csv(target + '.tmp', index=False, lineterminator='\r\n',
+                                        compression=COMPRESSION if is_compressed(target) else None)
+                for path in sources:
+                    remove_derived(path)
+                    if path != target:
+                        os.remove(path)
+                os.replace(target + '.tmp', target)
+                written.append(os.path.basename(target))
+        carry_over(ledger_file, old_version)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Split the ledger into time partitions and compact them')
+    parser.add_argument('command', choices=['migrate', 'compact', 'list'])
+    parser.add_argument('--ledger', default='transactions.csv')
+    parser.add_argument('--granularity', choices=GRANULARITIES[:2], default=GRANULARITY if GRANULARITY != 'none'
+                        else 'month', help='partitions of the current year, for migrate')
+    parser.add_argument('--all', action='store_true', help='also rewrite the current year and compacted years, for compact')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        print(f'Split {args.ledger} into {migrate(args.ledger, args.granularity)} partitions in '
+              f'{partition_dir(args.ledger)}')
+    elif not is_partitioned(args.ledger):
+        print(f'{args.ledger} is not partitioned, run migrate first')
+    elif args.command == 'compact':
+        written = compact(args.ledger, args.all)
+        print(f"Rewrote {len(written)} partitions{': ' + ', '.join(written) if written else ''}")
+    else:
+        for path in partition_files(args.ledger):
+            first, last = partition_range(os.path.basename(path))
+            print(f'{os.path.basename(path):<16} {first} to {last}  {os.path.getsize(path) / 1024:>10.1f} KB')
@@ -0,0 +1,112 @@
+# This file records how long each stage of the program takes, only when profiling is turned on
+# turn it on with FINANCE_TRACKER_PROFILE=1 (or a trace file path) or with python main.py --profile
+
+# importing libraries
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:
+    # windows has no resource module, peak memory is left out of the trace there
+    resource = None
+
+PROFILE_ENV = 'FINANCE_TRACKER_PROFILE'
+DEFAULT_TRACE_FILE = 'profile_trace.jsonl'
+
+# set by enable(), None means profiling is off
+trace_file = None
+run_id = None
+# names of the stages currently running in each thread, to record which stage each one is part of
+local = threading.local()
+
+# returns the running stages of the current thread
+def running_stages():
+    if not hasattr(local, 'stages'):
+        local.stages = []
+    return local.stages
+
+# turns profiling on, every stage is written as one json line to the trace file
+def enable(path=None):
+    global trace_file, run_id
+    trace_file = path or DEFAULT_TRACE_FILE
+    run_id = uuid.uuid4().hex[:12]
+
+# returns the peak resident memory of the process in megabytes
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# times one stage and writes it to the trace when it ends
+class Stage:
+    def __init__(self, name:str, fields:dict):
+        self.name = name
+        self.fields = fields
+
+    # adds fields like rows_out once they are known
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stages = running_stages()
+        self.parent = stages[-1] if stages else None
+        stages.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        running_stages().pop()
+        record = {'run': run_id, 'pid': os.getpid(), 'stage': self.name, 'parent': self.parent,
+                  'duration_ms': round(duration * 1000, 3), **self.fields, 'peak_rss_mb': peak_rss_mb()}
+        with open(trace_file, 'a') as file:
+            file.write(json.dumps(record, default=str) + '\n')
+
+# stands in for Stage when profiling is off, so instrumented code does no extra work
+class NullStage:
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULL_STAGE = NullStage()
+
+# returns a context manager timing a stage, e.g. with stage('read_csv', rows_in=n) as s: ... s.set(rows_out=m)
+def stage(name, **fields):
+    if trace_file is None:
+        return NULL_STAGE
+    return Stage(name, fields)
+
+# returns the number of rows of a dataframe-like value, None for anything else
+def row_count(value):
+    shape = getattr(value, 'shape', None)
+    return shape[0] if shape else None
+
+# decorator timing every call of a function as a stage, with the rows of its first argument and result
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if trace_file is None:
+                return func(*args, **kwargs)
+            with Stage(name, {'rows_in': row_count(args[0]) if args else None}) as current:
+                result = func(*args, **kwargs)
+                current.set(rows_out=row_count(result))
+                return result
+        return wrapper
+    return decorator
+
+if os.environ.get(PROFILE_ENV):
+    enable(None if os.environ[PROFILE_ENV] in ('1', 'true') else os.environ[PROFILE_ENV])
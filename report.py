@@ -0,0 +1,111 @@
+# This file renders every chart to image files without opening a window, one process per figure
+
+# importing libraries
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+# headless backend, set before pyplot is imported here or in a worker process
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import shutil
+import pandas as pd
+import chart_cache
+import chart_data
+import data_visuals
+
+DATE_FORMAT = '%m-%d-%Y'
+FORMATS = ('png', 'svg')
+CHARTS = {
+    'cash_flow': data_visuals.draw_cash_flow,
+    'categorical_expenses': data_visuals.draw_categorical_expenses,
+    'subcat_expenses': data_visuals.draw_subcat_expenses,
+    'monthly_spending': data_visuals.draw_cumsum_plot,
+}
+
+# draws one chart from its table and saves it, runs inside a worker process
+def render_chart(chart, table, path):
+    fig = CHARTS[chart](table, show=False)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+    return path
+
+# returns the table each chart needs for a month, so workers only receive small frames
+def period_tasks(period, monthly, daily_rows, out_dir, fmt):
+    tables = chart_data.tables_for_period(monthly, period, daily_rows)
+    # the report's pie chart only covers the month itself
+    month_grouped = chart_data.group_monthly(monthly[monthly['Month_Start'] == period.start_time], period)
+    tables['categorical_expenses'] = (chart_data.categorical_table(month_grouped), [str(period), str(period)])
+    # the monthly spending chart compares against the previous month, so it needs both
+    if tables['monthly_spending'][0]['Month_Period'].nunique() < 2:
+        del tables['monthly_spending']
+
+    return [(chart, table, months, os.path.join(out_dir, f'{period}_{chart}.{fmt}'))
+            for chart, (table, months) in tables.items() if not table.empty]
+
+# renders all charts for each month in periods, returns the paths of the saved files
+def render_report(csv_file, periods=None, out_dir='reports', fmt='png', workers=None, backend=None):
+    if fmt not in FORMATS:
+        raise ValueError(f'Format must be one of {FORMATS}')
+    os.makedirs(out_dir, exist_ok=True)
+
+    monthly = chart_data.load_monthly_totals(csv_file, DATE_FORMAT, backend)
+    # charts are cached next to whichever file holds the transactions
+    source = backend.db_file if backend is not None else csv_file
+    # defaults to the most recent month in the ledger
+    periods = periods or [chart_data.latest_period(monthly)]
+    # daily rows are only read for the months being reported and the month before each
+    daily_rows = chart_data.load_daily_rows(csv_file, DATE_FORMAT, min(periods) - 1, max(periods), backend)
+
+    tasks = []
+    for period in periods:
+        tasks.extend(period_tasks(period, monthly, daily_rows, out_dir, fmt))
+
+    # charts whose data hasn't changed are copied from the cache, only the rest are drawn
+    paths = []
+    misses = []
+    for chart, table, months, path in tasks:
+        key = chart_cache.chart_key(chart, table, {'format': fmt})
+        cached_path = chart_cache.get(source, key)
+        if cached_path is not None:
+            shutil.copyfile(cached_path, path)
+            paths.append(path)
+        else:
+            misses.append((key, months, (chart, table, path)))
+
+    if misses:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(key, months, executor.submit(render_chart, *task)) for key, months, task in misses]
+            for key, months, future in futures:
+                paths.append(future.result())
+                chart_cache.put(source, key, paths[-1], months)
+    return paths
+
+# returns the months of a year, or a single month, that have transactions
+def parse_periods(csv_file, year=None, month=None, backend=None):
+    if month:
+        return [pd.Period(month, freq='M')]
+    if year:
+        monthly = chart_data.load_monthly_totals(csv_file, DATE_FORMAT, backend)
+        months = sorted(monthly.loc[monthly['Month_Start'].dt.year == year, 'Month'].unique())
+        return [pd.Period(month, freq='M') for month in months]
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render all charts to image files')
+    parser.add_argument('csv_file', nargs='?', default='transactions.csv')
+    parser.add_argument('--year', type=int, help='render every month of a year')
+    parser.add_argument('--month', help='render a single month (yyyy-mm)')
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    parser.add_argument('--out', default='reports', help='output directory')
+    parser.add_argument('--workers', type=int, help='number of processes, defaults to the number of cpus')
+    parser.add_argument('--sqlite', metavar='DB_FILE', help='read transactions from a sqlite database')
+    args = parser.parse_args()
+
+    backend = None
+    if args.sqlite:
+        from sqlite_backend import SQLiteBackend
+        backend = SQLiteBackend(args.sqlite, DATE_FORMAT)
+    paths = render_report(args.csv_file, parse_periods(args.csv_file, args.year, args.month, backend),
+                          args.out, args.format, args.workers, backend)
+    print(f'Rendered {len(paths)} charts to {args.out}')
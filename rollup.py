@@ -0,0 +1,139 @@
+# This file keeps monthly totals of the ledger next to the csv so summaries don't rescan every row
+
+# importing libraries
+# pandas and storage are imported by the functions that rebuild or read the rollup,
+# so updating it from CSV.add_entry doesn't load them
+import json
+import os
+from datetime import datetime
+import partitions
+import profiling
+
+DATE_FORMAT = "%m-%d-%Y"
+MONTH_FORMAT = "%Y-%m"
+ROLLUP_COLUMNS = ['Month','Category','Sub-Category','Sum','Count','Min','Max']
+# sums, minimums and maximums are kept in integer cents, rollups written with float dollars are rebuilt
+ROLLUP_VERSION = 2
+
+# returns the path of the rollup file that sits next to a csv file
+def rollup_path(csv_file):
+    return os.path.splitext(csv_file)[0] + '_rollup.json'
+
+# returns the size and modified time used to tell if the rollup matches the csv
+# a partitioned ledger gives the total size and latest modified time of its partitions
+def source_version(csv_file):
+    if partitions.is_partitioned(csv_file):
+        return partitions.version(csv_file)
+    stat = os.stat(csv_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# reads the rollup file, returns None if there is no readable rollup
+def read_rollup(csv_file):
+    try:
+        with open(rollup_path(csv_file)) as file:
+            rollup = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return rollup if rollup.get('version') == ROLLUP_VERSION else None
+
+# writes the rollup totals along with the version of the csv they were built from
+# version is the csv version taken before its rows were read, the current one when the csv is locked
+def write_rollup(csv_file, totals, version=None):
+    rollup = {'version': ROLLUP_VERSION, 'source': version if version is not None else source_version(csv_file),
+              'totals': totals}
+    # write to a temporary file first so a crash never leaves a half written rollup
+    tmp_file = rollup_path(csv_file) + '.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(rollup, file)
+    os.replace(tmp_file, rollup_path(csv_file))
+
+# rebuilds the rollup from every transaction in the ledger
+@profiling.timed('build_rollup')
+def build_rollup(csv_file, date_format=DATE_FORMAT):
+    import storage
+    # the version is taken before reading, so rows appended meanwhile leave the rollup stale instead of missing them
+    version = source_version(csv_file)
+    df = storage.load_ledger(csv_file, columns=['Date','Category','Sub-Category','Amount'], date_format=date_format)
+    df['Month'] = df['Date'].dt.strftime(MONTH_FORMAT)
+    grouped = df.groupby(['Month','Category','Sub-Category'], observed=True)['Amount'].agg(['sum','count','min','max'])
+
+    totals = {}
+    for (month, category, sub_category), row in grouped.iterrows():
+        totals['|'.join([month, str(category), str(sub_category)])] = [int(row['sum']), int(row['count']),
+                                                                     int(row['min']), int(row['max'])]
+    write_rollup(csv_file, totals, version)
+    return totals
+
+# adds appended transactions to the rollup, previous_version is the csv version before the append
+def add_to_rollup(csv_file, entries, previous_version, date_format=DATE_FORMAT):
+    new_totals = {}
+    for entry in entries:
+        month = datetime.strptime(entry['Date'], date_format).strftime(MONTH_FORMAT)
+        key = '|'.join([month, entry['Category'], entry['Sub-Category']])
+        amount = round(float(entry['Amount']) * 100)
+        if key in new_totals:
+            total, count, low, high = new_totals[key]
+            new_totals[key] = [total + amount, count + 1, min(low, amount), max(high, amount)]
+        else:
+            new_totals[key] = [amount, 1, amount, amount]
+    merge_into_rollup(csv_file, new_totals, previous_version)
+
+# merges the totals of newly appended rows into the rollup
+def merge_into_rollup(csv_file, new_totals, previous_version):
+    rollup = read_rollup(csv_file)
+    # a missing or stale rollup is rebuilt the next time it is loaded
+    if rollup is None or rollup['source'] != previous_version:
+        return
+
+    totals = rollup['totals']
+    for key, (amount, count, low, high) in new_totals.items():
+        if key in totals:
+            total, old_count, old_low, old_high = totals[key]
+            totals[key] = [total + amount, old_count + count, min(old_low, low), max(old_high, high)]
+        else:
+            totals[key] = [amount, count, low, high]
+    write_rollup(csv_file, totals)
+
+# returns the rollup as a dataframe with amounts in cents, rebuilding it first if it is missing or stale
+@profiling.timed('load_rollup')
+def load_rollup(csv_file, date_format=DATE_FORMAT):
+    import pandas as pd
+    rollup = read_rollup(csv_file)
+    if rollup is None or rollup['source'] != source_version(csv_file):
+        totals = build_rollup(csv_file, date_format)
+    else:
+        totals = rollup['totals']
+
+    rows = [key.split('|') + values for key, values in totals.items()]
+    return pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+
+# returns the amount in cents and count of each category between two dates
+# whole months come from the rollup and only the months cut by the range are read row by row
+@profiling.timed('range_totals')
+def range_totals(csv_file, start_date, end_date, date_format=DATE_FORMAT):
+    import pandas as pd
+    import storage
+    rollup_df = load_rollup(csv_file, date_format)
+    months = pd.PeriodIndex(rollup_df['Month'], freq='M')
+    full_months = (months.start_time >= start_date) & (months.end_time.normalize() <= end_date)
+    cut_months = ~full_months & (months.end_time >= start_date) & (months.start_time <= end_date)
+
+    totals_df = rollup_df.loc[full_months, ['Category','Sum','Count']].rename(columns={'Sum': 'Amount'})
+    if cut_months.any():
+        df = storage.query_ledger(csv_file, {'Start Date': start_date, 'End Date': end_date},
+                                  columns=['Date','Category','Amount'], date_format=date_format)
+        df = df[df['Date'].dt.to_period('M').isin(months[cut_months])]
+        df = df.assign(Category=df['Category'].astype(str), Count=1)
+        totals_df = pd.concat([totals_df, df[['Category','Amount','Count']]])
+
+    return totals_df.groupby('Category')[['Amount','Count']].sum().reset_index()
+
+# returns the income, spending and savings in dollars and the number of transactions
+# from the amount in cents and count of each category, like range_totals returns them
+def summary_totals(category_totals):
+    return {
+        'Income': category_totals[category_totals['Category']=='Income']['Amount'].sum() / 100,
+        'Spent': category_totals[~category_totals['Category'].isin(['Income','Savings'])]['Amount'].sum() / 100,
+        'Savings': category_totals[category_totals['Category'].isin(['Savings & Investments'])]['Amount'].sum() / 100,
+        'Count': category_totals['Count'].sum()
+    }
@@ -0,0 +1,347 @@
+# This file runs a local query server that keeps the ledger in memory between requests
+# scripts and dashboards get summaries, filtered transactions and chart data from it as json over http,
+# instead of each one loading transactions.csv again
+# e.g. python server.py --port 8750, then GET http://127.0.0.1:8750/summary?start=01-01-2024&end=01-31-2024
+
+# importing libraries
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import chart_data
+from data_entry import DATE_FORMAT, check_entry
+import functions
+from main import CSV
+import profiling
+import rollup
+import storage
+
+HOST = '127.0.0.1'
+PORT = 8750
+WORKERS = 4
+# latencies kept for each endpoint, the percentiles in /metrics are over these
+LATENCY_WINDOW = 1000
+# rows returned by /transactions unless the request asks for another limit
+ROW_LIMIT = 1000
+# query parameters of /transactions and the filters of functions.filter_transaction_dataframe they set
+FILTER_PARAMS = {
+    'start': 'Start Date',
+    'end': 'End Date',
+    'category': 'Category',
+    'sub_category': 'Sub-Category',
+    'min_amount': 'Lower Amount',
+    'max_amount': 'Upper Amount',
+    'keywords': 'Keywords',
+    'memo_prefix': 'Memo Prefix',
+}
+LIST_FILTERS = ['Category', 'Sub-Category', 'Keywords']
+
+# one version of the ledger, a request reads a single snapshot from start to end
+# so a transaction appended meanwhile never shows up halfway through an answer
+class Snapshot:
+    def __init__(self, df, signature):
+        self.df = df
+        self.signature = signature
+        self.lock = threading.Lock()
+        self.monthly = None
+
+    # returns the totals in cents of each month, category and sub-category, grouped once per snapshot
+    # they come from the snapshot instead of the rollup file, which a writer may be updating
+    def monthly_totals(self):
+        with self.lock:
+            if self.monthly is None:
+                df = self.df
+                months = pd.Series(df['Date'].to_numpy().astype('datetime64[M]'), index=df.index)
+                monthly = (df.assign(Month_Start=months)
+                             .groupby(['Month_Start','Category','Sub-Category'], observed=True)['Amount']
+                             .agg(Sum='sum', Count='size')
+                             .reset_index())
+                monthly['Month'] = monthly['Month_Start'].dt.strftime(rollup.MONTH_FORMAT)
+                self.monthly = monthly
+        return self.monthly
+
+# keeps the newest snapshot of the ledger, reading only the rows appended since the last one
+class LedgerState:
+    def __init__(self, csv_file:str, date_format:str=DATE_FORMAT):
+        self.csv_file = csv_file
+        self.date_format = date_format
+        self.refresh_lock = threading.Lock()
+        # adds from the server run one at a time so each one's duplicate check sees the ones before it
+        self.write_lock = threading.Lock()
+        self.refreshes = 0
+        self.snapshot = None
+        self.refresh()
+
+    # loads the ledger again, the session cache of storage only parses the rows appended since the last load
+    def refresh(self):
+        signature = storage.file_signature(self.csv_file)
+        df = storage.load_ledger(self.csv_file, date_format=self.date_format)
+        # swapping the reference is atomic, requests still reading the old snapshot keep it until they finish
+        self.snapshot = Snapshot(df, signature)
+        self.refreshes += 1
+
+    # returns the newest snapshot, refreshing it first if the csv changed
+    # a request that finds another one refreshing doesn't wait and answers from the snapshot it has
+    def current(self):
+        if storage.file_signature(self.csv_file) != self.snapshot.signature:
+            if self.refresh_lock.acquire(blocking=False):
+                try:
+                    self.refresh()
+                finally:
+                    self.refresh_lock.release()
+        return self.snapshot
+
+    # adds transactions and refreshes, so the answer to the next request from the same client has them
+    def add_entries(self, entries):
+        with self.write_lock:
+            added, messages = CSV.add_entries(entries)
+        with self.refresh_lock:
+            self.refresh()
+        return added, messages
+
+# keeps the latency of the last requests of each endpoint
+class LatencyMetrics:
+    def __init__(self, window:int=LATENCY_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+        self.errors = {}
+
+    def record(self, endpoint:str, seconds:float, error:bool=False):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds * 1000)
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + error
+
+    # returns the count, errors and latency percentiles in milliseconds of each endpoint
+    def summary(self):
+        with self.lock:
+            latencies = {endpoint: np.array(values) for endpoint, values in self.latencies.items()}
+            counts, errors = dict(self.counts), dict(self.errors)
+        return {endpoint: {'requests': counts[endpoint], 'errors': errors[endpoint],
+                           'mean_ms': round(float(values.mean()), 3),
+                           'p50_ms': round(float(np.percentile(values, 50)), 3),
+                           'p95_ms': round(float(np.percentile(values, 95)), 3),
+                           'p99_ms': round(float(np.percentile(values, 99)), 3),
+                           'max_ms': round(float(values.max()), 3)}
+                for endpoint, values in latencies.items()}
+
+# returns the rows of a dataframe as json-ready dictionaries, dates in the ledger's format
+def records(df, date_format=DATE_FORMAT):
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.PeriodDtype):
+            df[col] = df[col].astype(str)
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime(date_format)
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return json.loads(df.to_json(orient='records'))
+
+# returns the version a response was answered from, so clients can tell two answers came from the same ledger
+def version(snapshot):
+    return {'rows': len(snapshot.df), 'size': snapshot.signature['size'], 'mtime_ns': snapshot.signature['mtime_ns']}
+
+# returns the totals of a date range, like CSV.get_summary prints them
+def summary(snapshot, params, date_format=DATE_FORMAT):
+    start = pd.to_datetime(param(params, 'start', required=True), format=date_format)
+    end = pd.to_datetime(param(params, 'end', required=True), format=date_format)
+    df = snapshot.df
+    # only the columns the totals need are cut to the range, copying memos would take most of the time
+    rows = df[['Category','Amount']][((df['Date'] >= start) & (df['Date'] <= end)).to_numpy()]
+    category_totals = (rows.groupby('Category', observed=True)['Amount']
+                           .agg(Amount='sum', Count='size')
+                           .reset_index()
+                           .astype({'Category': str}))
+    totals = rollup.summary_totals(category_totals)
+    return {**totals, 'Count': int(totals['Count']),
+            'Categories': records(category_totals.assign(Amount=category_totals['Amount'] / 100)),
+            'version': version(snapshot)}
+
+# returns the filters of a /transactions request in the form functions.filter_transaction_dataframe takes
+def parse_filters(params, date_format=DATE_FORMAT):
+    filters = {}
+    for name, filter_name in FILTER_PARAMS.items():
+        value = param(params, name)
+        if value is None:
+            continue
+        if filter_name in ('Start Date', 'End Date'):
+            value = pd.to_datetime(value, format=date_format)
+        elif filter_name in ('Lower Amount', 'Upper Amount'):
+            value = float(value)
+        elif filter_name in LIST_FILTERS:
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        filters[filter_name] = value
+    return filters
+
+# returns the transactions matching the filters, keywords and memo prefixes use the memo index
+# the index matches rows by their position in the files on disk, which a backdated add to an earlier partition
+# shifts, so a snapshot older than the files has its memos scanned instead
+def transactions(snapshot, params, csv_file, date_format=DATE_FORMAT):
+    filters = parse_filters(params, date_format)
+    rows = None
+    if storage.file_signature(csv_file) == snapshot.signature:
+        rows = functions.filter_transaction_dataframe(snapshot.df, filters, csv_file)
+        # the files only move forward, so if they still match the snapshot they matched it throughout
+        if storage.file_signature(csv_file) != snapshot.signature:
+            rows = None
+    if rows is None:
+        rows = functions.filter_transaction_dataframe(snapshot.df, filters)
+    limit = int(param(params, 'limit') or ROW_LIMIT)
+    return {'count': len(rows), 'transactions': records(storage.to_display(rows.head(limit)), date_format),
+            'version': version(snapshot)}
+
+# returns the tables of the charts for a month ('yyyy-mm'), the latest one by default
+def charts(snapshot, params):
+    names = (param(params, 'chart') or ','.join(chart_data.CHARTS)).split(',')
+    unknown = [name for name in names if name not in chart_data.CHARTS]
+    if unknown:
+        raise ValueError(f'Invalid chart {unknown[0]!r}. Use one of: {", ".join(chart_data.CHARTS)}')
+    if snapshot.df.empty:
+        raise ValueError('There are no transactions to chart.')
+    monthly = snapshot.monthly_totals()
+    month = param(params, 'period')
+    period = pd.Period(month, freq='M') if month else chart_data.latest_period(monthly)
+
+    daily_rows = None
+    if 'monthly_spending' in names:
+        df = snapshot.df
+        dates = df['Date']
+        daily_rows = df[((dates >= (period - 1).start_time) & (dates <= period.end_time)
+                         & (df['Category'] != 'Income')).to_numpy()]
+    tables = chart_data.tables_for_period(monthly, period, daily_rows, names)
+    return {'period': str(period), 'version': version(snapshot),
+            'charts': {chart: {'months': months, 'rows': records(table)} for chart, (table, months) in tables.items()}}
+
+# returns a single query parameter, raising ValueError if a required one is missing
+def param(params, name, required=False):
+    values = params.get(name)
+    if not values:
+        if required:
+            raise ValueError(f'Missing parameter {name!r}.')
+        return None
+    return values[0]
+
+# answers each request from the current snapshot of the ledger
+class RequestHandler(BaseHTTPRequestHandler):
+    # set on a subclass by make_server
+    state = None
+    metrics = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        state = self.state
+        routes = {
+            '/summary': lambda: summary(state.current(), params, state.date_format),
+            '/transactions': lambda: transactions(state.current(), params, state.csv_file, state.date_format),
+            '/charts': lambda: charts(state.current(), params),
+            '/metrics': lambda: {'endpoints': self.metrics.summary(), 'refreshes': state.refreshes,
+                                 'version': version(state.snapshot)},
+        }
+        self.answer(url.path, routes.get(url.path))
+
+    # adds transactions sent as a json list of {"Date", "Category", "Sub-Category", "Memo", "Amount"}
+    def do_POST(self):
+        url = urlparse(self.path)
+
+        def add():
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'[]')
+            entries = body if isinstance(body, list) else [body]
+            for entry in entries:
+                entry['Memo'] = entry.get('Memo') or ''
+                entry['Category'] = check_entry(entry['Date'], entry['Category'], entry['Sub-Category'],
+                                                entry['Memo'], float(entry['Amount']), self.state.date_format)
+            added, messages = self.state.add_entries(entries)
+            return {'added': added, 'messages': messages, 'version': version(self.state.snapshot)}
+
+        self.answer(url.path, add if url.path == '/transactions' else None)
+
+    # runs a route, sends its result as json and records how long it took
+    def answer(self, path, route):
+        start = time.perf_counter()
+        status = 200
+        try:
+            if route is None:
+                status, result = 404, {'error': f'Unknown path {path!r}.'}
+            else:
+                with profiling.stage(f'server{path.replace("/", ".")}'):
+                    result = route()
+        except (ValueError, KeyError) as e:
+            status, result = 400, {'error': str(e)}
+        except Exception as e:
+            status, result = 500, {'error': str(e)}
+
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if route is not None:
+            self.metrics.record(path, time.perf_counter() - start, error=status != 200)
+
+    # requests are counted in /metrics instead of printed
+    def log_message(self, format, *args):
+        pass
+
+# http server that answers requests on a fixed pool of worker threads
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, address, handler, workers:int=WORKERS):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+# loads the ledger and returns a server for it that hasn't started answering yet
+def make_server(csv_file, host=HOST, port=PORT, workers=WORKERS, date_format=DATE_FORMAT):
+    CSV.CSV_file = csv_file
+    CSV.DATE_FORMAT = date_format
+    CSV.initialize_csv()
+    handler = type('LedgerRequestHandler', (RequestHandler,),
+                   {'state': LedgerState(csv_file, date_format), 'metrics': LatencyMetrics()})
+    return PooledHTTPServer((host, port), handler, workers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve summaries, transactions and chart data of a ledger on localhost')
+    parser.add_argument('--ledger', default='transactions.csv')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='requests answered at the same time')
+    args = parser.parse_args()
+
+    if CSV.BACKEND != 'csv':
+        print('The query server keeps the csv ledger in memory, set FINANCE_TRACKER_BACKEND=csv to use it.')
+        sys.exit(1)
+
+    server = make_server(args.ledger, args.host, args.port, args.workers)
+    print(f'Serving {args.ledger} on http://{args.host}:{server.server_port} '
+          f'(/summary, /transactions, /charts, /metrics), Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        storage.save_store(args.ledger)
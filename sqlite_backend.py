@@ -0,0 +1,168 @@
+# This file stores transactions in an indexed SQLite database instead of the csv file
+
+# importing libraries
+# pandas is only imported by the methods that return dataframes, adding rows only needs sqlite3
+import argparse
+import sqlite3
+from datetime import datetime
+
+DATE_FORMAT = "%m-%d-%Y"
+# dates are stored as yyyy-mm-dd so they sort and compare as text
+DB_DATE_FORMAT = "%Y-%m-%d"
+MIGRATE_BATCH_SIZE = 50_000
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        sub_category TEXT NOT NULL,
+        memo TEXT NOT NULL DEFAULT '',
+        amount REAL NOT NULL
+    )""",
+    # covers date range totals and monthly groupings without reading the table itself
+    "CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date, category, sub_category, amount)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (category, date)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_sub_category ON transactions (sub_category, date)",
+]
+
+# the sql each filter of functions.filter_transaction_dataframe turns into
+FILTER_SQL = {
+    ('Date', '>='): 'date >= ?',
+    ('Date', '<='): 'date <= ?',
+    ('Amount', '>='): 'amount >= ?',
+    ('Amount', '<='): 'amount <= ?',
+}
+FILTER_COLUMNS = {'Category': 'category', 'Sub-Category': 'sub_category'}
+# amounts are stored in dollars and returned in integer cents, like storage.load_ledger
+CENTS = 'CAST(ROUND(amount * 100) AS INTEGER)'
+
+# creating a class to house the database methods
+class SQLiteBackend:
+    def __init__(self, db_file:str, date_format:str=DATE_FORMAT):
+        self.db_file = db_file
+        self.date_format = date_format
+
+    # opens a connection, creating the table and indexes the first time
+    def connect(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    # converts a ledger date (mm-dd-yyyy) to the stored format
+    def to_db_date(self, date):
+        if isinstance(date, str):
+            date = datetime.strptime(date, self.date_format)
+        return date.strftime(DB_DATE_FORMAT)
+
+    # inserts many transactions in a single database transaction
+    # replace deletes every stored transaction in the same database transaction first
+    def add_entries(self, entries:list, replace:bool=False):
+        rows = [(self.to_db_date(entry['Date']), entry['Category'], entry['Sub-Category'],
+                 entry['Memo'] or '', float(entry['Amount'])) for entry in entries]
+        conn = self.connect()
+        try:
+            with conn:
+                if replace:
+                    conn.execute('DELETE FROM transactions')
+                conn.executemany('INSERT INTO transactions (date, category, sub_category, memo, amount) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+        finally:
+            conn.close()
+
+    # runs a query and returns the result as a dataframe
+    def read_sql(self, query, params=()):
+        import pandas as pd
+        conn = self.connect()
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+
+    # returns the amount in cents and count of each category between two dates, like rollup.range_totals
+    def range_totals(self, start_date, end_date):
+        return self.read_sql(f'SELECT category AS "Category", SUM({CENTS}) AS "Amount", COUNT(*) AS "Count" '
+                             'FROM transactions WHERE date BETWEEN ? AND ? GROUP BY category',
+                             (self.to_db_date(start_date), self.to_db_date(end_date)))
+
+    # returns the totals in cents of each month, category and sub-category, like rollup.load_rollup
+    def monthly_totals(self):
+        return self.read_sql('SELECT substr(date, 1, 7) AS "Month", category AS "Category", '
+                             f'sub_category AS "Sub-Category", SUM({CENTS}) AS "Sum", COUNT(*) AS "Count", '
+                             f'MIN({CENTS}) AS "Min", MAX({CENTS}) AS "Max" '
+                             'FROM transactions GROUP BY 1, 2, 3 ORDER BY 1')
+
+    # returns the transactions matching the filters, typed like storage.load_ledger
+    def load_transactions(self, columns:list=None, filters:dict=None):
+        import pandas as pd
+        import storage
+        conditions = []
+        params = []
+        # memo words have no index in the database, they are matched on the rows the other filters return
+        memo_predicates, predicates = storage.split_memo_predicates(storage.filter_predicates(filters or {}))
+        for column, operator, value in predicates:
+            if operator == 'in':
+                conditions.append(f"{FILTER_COLUMNS[column]} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                conditions.append(FILTER_SQL[(column, operator)])
+                if column == 'Date':
+                    value = self.to_db_date(pd.Timestamp(value))
+                else:
+                    value = value / 100
+                params.append(value)
+
+        query = ('SELECT date AS "Date", category AS "Category", sub_category AS "Sub-Category", '
+                 'memo AS "Memo", amount AS "Amount" FROM transactions')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        df = self.read_sql(query + ' ORDER BY id', params)
+        df['Date'] = pd.to_datetime(df['Date'], format=DB_DATE_FORMAT)
+        df['Amount'] = storage.to_cents(df['Amount'])
+        for col in storage.CATEGORICAL_COLUMNS:
+            df[col] = storage.encode_categories(df[col], col)
+        if memo_predicates:
+            df = df[storage.dataframe_mask(df, memo_predicates)]
+        return df[columns] if columns else df
+
+    # returns the number of stored transactions
+    def count(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        finally:
+            conn.close()
+
+    # copies every transaction of a csv ledger into an empty database, in batches
+    def migrate_from_csv(self, csv_file):
+        import pandas as pd
+        if self.count():
+            raise ValueError(f'{self.db_file} already has transactions, migrate into an empty database')
+        import partitions
+        count = 0
+        for path in partitions.ledger_files(csv_file):
+            for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=MIGRATE_BATCH_SIZE):
+                self.add_entries(chunk.to_dict('records'))
+                count += len(chunk)
+        return count
+
+    # writes every transaction back out in the csv ledger layout
+    def export_csv(self, csv_file):
+        import storage
+        storage.to_ledger_csv(self.load_transactions(), self.date_format).to_csv(csv_file, index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Move a csv ledger into SQLite or back')
+    parser.add_argument('command', choices=['migrate', 'export'])
+    parser.add_argument('csv_file', nargs='?', default='transactions.csv')
+    parser.add_argument('db_file', nargs='?', default='transactions.db')
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(args.db_file)
+    if args.command == 'migrate':
+        print(f'Migrated {backend.migrate_from_csv(args.csv_file)} transactions into {args.db_file}')
+    else:
+        backend.export_csv(args.csv_file)
+        print(f'Exported {args.db_file} to {args.csv_file}')
@@ -0,0 +1,47 @@
+# This file measures how long the program takes to start and to add a transaction from the command line
+
+# importing libraries
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'matplotlib', 'seaborn']
+
+# runs a command in a fresh interpreter and returns the wall time in seconds
+def time_command(args, cwd):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+# returns the heavy libraries that get imported along with main.py
+def heavy_imports():
+    code = f"import sys; sys.path.insert(0, {HERE!r}); import main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return [name for name in result.stdout.strip().split(',') if name]
+
+# returns the median time of importing main.py and of one 'main.py add' over a number of runs
+def measure(runs=5):
+    import_times = []
+    add_times = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(runs):
+            import_times.append(time_command(['-c', f'import sys; sys.path.insert(0, {HERE!r}); import main'], tmp_dir))
+            add_times.append(time_command([os.path.join(HERE, 'main.py'), 'add', '--category', 'N',
+                                           '--sub-category', 'Other', '--memo', 'startup', '--amount', '1'], tmp_dir))
+    return {'import_main': statistics.median(import_times), 'add': statistics.median(add_times)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure startup time of main.py')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    times = measure(args.runs)
+    print(f"import main:  {times['import_main'] * 1000:.1f} ms")
+    print(f"main.py add:  {times['add'] * 1000:.1f} ms")
+    loaded = heavy_imports()
+    print(f"heavy libraries loaded at startup: {', '.join(loaded) if loaded else 'none'}")
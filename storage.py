@@ -0,0 +1,380 @@
+# This file keeps a columnar copy of the transactions csv so it can be loaded without re-parsing
+
+# importing libraries
+import io
+import os
+import sys
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+from data_entry import CATEGORIES, SUB_CATEGORIES
+import memo_index
+import partitions
+import profiling
+
+DATE_FORMAT = "%m-%d-%Y"
+COLUMNS = ['Date','Category','Sub-Category','Memo','Amount']
+# columns stored as dictionary encoded values
+CATEGORICAL_COLUMNS = ['Category','Sub-Category']
+# categories are codes into these fixed lists, so every load and append encodes them the same way
+FIXED_CATEGORIES = {
+    'Category': list(CATEGORIES.values()),
+    'Sub-Category': list(dict.fromkeys(name for names in SUB_CATEGORIES.values() for name in names)),
+}
+# keys saved in the store to know which version of the csv it was built from
+SOURCE_SIZE_KEY = b'source_size'
+SOURCE_MTIME_KEY = b'source_mtime_ns'
+# stores written with an older layout (amounts as float dollars) are rebuilt
+SCHEMA_KEY = b'schema_version'
+SCHEMA_VERSION = b'2'
+# filter names used by functions.filter_transaction_dataframe and the predicate each one becomes
+FILTER_PREDICATES = {
+    "Start Date": ('Date', '>='),
+    "End Date": ('Date', '<='),
+    "Category": ('Category', 'in'),
+    "Sub-Category": ('Sub-Category', 'in'),
+    "Lower Amount": ('Amount', '>='),
+    "Upper Amount": ('Amount', '<='),
+    # words every memo must have, and the start of a word one of its words must have
+    "Keywords": ('Memo', 'keywords'),
+    "Memo Prefix": ('Memo', 'prefix'),
+}
+# bytes before the old end of file compared to make sure the file was only appended to
+TAIL_CHECK_BYTES = 64
+
+# parsed ledgers kept for the rest of the session, keyed by the absolute csv path
+_session_cache = {}
+# reentrant, a partitioned ledger loads its partitions while holding it
+_cache_lock = threading.RLock()
+
+# returns the path of the columnar store that sits next to a csv file
+def store_path(csv_file):
+    return partitions.stem(csv_file) + '.feather'
+
+# reads the csv ledger and converts every column to its typed form
+def read_ledger_csv(csv_file, date_format=DATE_FORMAT):
+    # memos are read as plain text so values like 'NA' are kept as they were typed
+    with profiling.stage('read_csv') as current:
+        df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+        current.set(rows_out=len(df))
+    return type_ledger(df, date_format)
+
+# returns amounts in dollars as integer cents, so totals add up exactly
+# a blank or unreadable amount, e.g. from a hand edited csv, is kept as a missing value that totals skip
+def to_cents(amounts):
+    cents = (pd.to_numeric(amounts, errors='coerce') * 100).round()
+    return cents.astype('Int64' if cents.isna().any() else 'int64')
+
+# returns values encoded as codes into the fixed list of a column
+def encode_categories(values, col):
+    categories = FIXED_CATEGORIES[col]
+    encoded = pd.Categorical(values, categories=categories)
+    # values outside the list, e.g. from a hand edited csv, are added after it instead of being lost
+    if (encoded.codes == -1).any():
+        extra = sorted(set(values[encoded.codes == -1]))
+        encoded = pd.Categorical(values, categories=categories + extra)
+    return encoded
+
+# parses dates, turns amounts into cents and encodes categories of a raw string dataframe
+@profiling.timed('parse_types')
+def type_ledger(df, date_format=DATE_FORMAT):
+    df = df.reindex(columns=COLUMNS)
+    df['Date'] = pd.to_datetime(df['Date'], format=date_format)
+    df['Amount'] = to_cents(df['Amount'])
+    df['Memo'] = df['Memo'].fillna('').astype(str)
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = encode_categories(df[col].astype(str), col)
+    return df
+
+# writes a typed dataframe to the columnar store, remembering which csv it came from
+# closed years of a partitioned ledger are stored compressed with zstd, they are read whole and rarely
+@profiling.timed('write_store')
+def write_store(df, store_file, csv_file=None, compression='uncompressed'):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SCHEMA_KEY] = SCHEMA_VERSION
+    if csv_file is not None:
+        stat = os.stat(csv_file)
+        metadata[SOURCE_SIZE_KEY] = str(stat.st_size).encode()
+        metadata[SOURCE_MTIME_KEY] = str(stat.st_mtime_ns).encode()
+    table = table.replace_schema_metadata(metadata)
+    # stored uncompressed so the file can be memory-mapped
+    # and written through a temporary file, loaded ledgers still map the old one and its strings must stay valid,
+    # each writer gets its own so two processes refreshing the store at once don't write into the same one
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(store_file)), suffix='.tmp',
+                                     delete=False) as tmp_file:
+        tmp_path = tmp_file.name
+    try:
+        feather.write_feather(table, tmp_path, compression=compression)
+        os.replace(tmp_path, store_file)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# checks if the store was built from the current version of the csv file
+def is_store_current(csv_file, store_file):
+    if not os.path.exists(store_file):
+        return False
+    metadata = feather.read_table(store_file, columns=[], memory_map=True).schema.metadata or {}
+    stat = os.stat(csv_file)
+    return (metadata.get(SCHEMA_KEY) == SCHEMA_VERSION
+            and metadata.get(SOURCE_SIZE_KEY) == str(stat.st_size).encode()
+            and metadata.get(SOURCE_MTIME_KEY) == str(stat.st_mtime_ns).encode())
+
+# builds the columnar store from a csv file in the ledger layout
+def csv_to_store(csv_file, store_file=None, date_format=DATE_FORMAT):
+    store_file = store_file or store_path(csv_file)
+    df = read_ledger_csv(csv_file, date_format)
+    write_store(df, store_file, csv_file, 'zstd' if partitions.is_compressed(csv_file) else 'uncompressed')
+    return df
+
+# writes the columnar store back out in the ledger csv layout
+def store_to_csv(store_file, csv_file, date_format=DATE_FORMAT):
+    df = read_store(store_file)
+    to_ledger_csv(df, date_format).to_csv(csv_file, index=False)
+
+# converts a typed dataframe back to the strings used in the csv file
+def to_ledger_csv(df, date_format=DATE_FORMAT):
+    csv_df = df[COLUMNS].copy()
+    csv_df['Date'] = csv_df['Date'].dt.strftime(date_format)
+    csv_df['Amount'] = csv_df['Amount'] / 100
+    for col in CATEGORICAL_COLUMNS:
+        csv_df[col] = csv_df[col].astype(str)
+    return csv_df
+
+# returns transactions with amounts back in dollars, the way they are shown to the user
+def to_display(df):
+    return df.assign(Amount=df['Amount'] / 100) if 'Amount' in df else df
+
+# reads the columnar store, optionally only some of its columns
+# the whole file is mapped and only the columns asked for are converted, reading a subset would copy them instead
+@profiling.timed('read_store')
+def read_store(store_file, columns=None):
+    table = feather.read_table(store_file, memory_map=True)
+    return (table.select(columns) if columns else table).to_pandas()
+
+# returns what identifies a version of the csv file, or of all partitions of a partitioned ledger
+def file_signature(csv_file):
+    if partitions.is_partitioned(csv_file):
+        return partitions.signature(csv_file)
+    stat = os.stat(csv_file)
+    return {'identity': (stat.st_dev, stat.st_ino), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# returns the last bytes before an offset of a file
+def read_check_bytes(csv_file, offset):
+    with open(csv_file, 'rb') as file:
+        file.seek(max(offset - TAIL_CHECK_BYTES, 0))
+        return file.read(min(offset, TAIL_CHECK_BYTES))
+
+# checks if the only change to the csv since it was cached is rows appended to the end
+def is_append_only(cached, signature, csv_file):
+    return (cached['signature']['identity'] == signature['identity']
+            and cached['signature']['size'] < signature['size']
+            and cached['check_bytes'].endswith(b'\n')
+            and read_check_bytes(csv_file, cached['signature']['size']) == cached['check_bytes'])
+
+# parses only the rows appended after the cached end of file and adds them to the cached ledger
+# returns the ledger and how many bytes of the tail were read
+@profiling.timed('read_appended_rows')
+def read_appended_rows(csv_file, cached, signature, date_format=DATE_FORMAT):
+    with open(csv_file, 'rb') as file:
+        file.seek(cached['signature']['size'])
+        tail = file.read(signature['size'] - cached['signature']['size'])
+    # a writer may still be in the middle of a row, so stop at the last complete line
+    tail = tail[:tail.rfind(b'\n') + 1]
+    tail_df = pd.read_csv(io.BytesIO(tail), names=COLUMNS, header=None, dtype=str, keep_default_na=False)
+    tail_df = type_ledger(tail_df, date_format)
+
+    return concat_ledgers([cached['df'], tail_df]), len(tail)
+
+# joins typed ledgers one after the other, rows are numbered again from 0
+def concat_ledgers(frames):
+    # an empty frame filtered from the store has no categories at all, so it is left out
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    df = pd.concat(frames, ignore_index=True)
+    # concat falls back to plain strings when the frames have different categories, so merge the dictionaries
+    for col in CATEGORICAL_COLUMNS:
+        if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = union_categoricals([frame[col] for frame in frames], ignore_order=True)
+    return df
+
+# returns a typed ledger without rows
+def empty_ledger(date_format=DATE_FORMAT):
+    return type_ledger(pd.DataFrame({col: pd.Series(dtype=str) for col in COLUMNS}), date_format)
+
+# returns the typed rows of every partition of a partitioned ledger overlapping a date range, oldest first
+def partition_frames(csv_file, date_format=DATE_FORMAT, start=None, end=None):
+    return [(path, load_ledger(path, date_format=date_format))
+            for path in partitions.partition_files(csv_file, start, end)]
+
+# returns all partitions joined into one ledger, numbered in partition order, kept until a partition changes
+# with columns, partitions that aren't cached only read those columns, and the joined ledger isn't kept
+def load_partitioned(csv_file, date_format=DATE_FORMAT, columns=None):
+    with _cache_lock:
+        key = os.path.abspath(csv_file)
+        signature = file_signature(csv_file)
+        cached = _session_cache.get(key)
+        if (cached is None or cached['signature'] != signature) and columns:
+            frames = [load_ledger(path, columns, date_format) for path in partitions.partition_files(csv_file)]
+            return concat_ledgers(frames) if frames else empty_ledger(date_format)[columns]
+        if cached is None or cached['signature'] != signature:
+            frames = [df for path, df in partition_frames(csv_file, date_format)]
+            df = concat_ledgers(frames) if frames else empty_ledger(date_format)
+            cached = _session_cache[key] = {'signature': signature, 'df': df}
+        return cached['df']
+
+# returns the typed ledger, from the session cache when the csv is unchanged or only appended to
+@profiling.timed('load_ledger')
+def load_ledger(csv_file, columns=None, date_format=DATE_FORMAT):
+    if partitions.is_partitioned(csv_file):
+        df = load_partitioned(csv_file, date_format, columns)
+        return df[columns] if columns else df.copy(deep=False)
+
+    # threads of the query server share the cache, so one of them reads a new tail at a time
+    with _cache_lock:
+        key = os.path.abspath(csv_file)
+        signature = file_signature(csv_file)
+        cached = _session_cache.get(key)
+        store_file = store_path(csv_file)
+
+        if cached is not None and cached['signature'] == signature:
+            df = cached['df']
+        # rows appended to a compressed partition are a new gzip member, so it is read again instead of its tail
+        elif cached is not None and not partitions.is_compressed(csv_file) and is_append_only(cached, signature,
+                                                                                             csv_file):
+            # the store isn't rewritten for every tail, save_store does it once when the session ends
+            df, tail_size = read_appended_rows(csv_file, cached, signature, date_format)
+            read_size = cached['signature']['size'] + tail_size
+            if read_size != signature['size']:
+                # the unfinished row is read the next time the ledger is loaded
+                signature = dict(signature, size=read_size)
+        elif is_store_current(csv_file, store_file) and columns:
+            # only the columns asked for are read, the cache keeps whole ledgers so this one isn't kept
+            return read_store(store_file, columns)
+        elif is_store_current(csv_file, store_file):
+            df = read_store(store_file)
+        else:
+            # rebuilding the store if the csv has changed
+            df = csv_to_store(csv_file, store_file, date_format)
+
+        _session_cache[key] = {'signature': signature, 'df': df,
+                               'check_bytes': read_check_bytes(csv_file, signature['size'])}
+    # callers get their own frame so adding columns never changes the cached one
+    return df[columns] if columns else df.copy(deep=False)
+
+# writes the rows the session cache read from the tail of the csv, or of each partition, to the columnar store
+# so the next session maps the store instead of parsing them again
+def save_store(csv_file):
+    with _cache_lock:
+        for path in partitions.ledger_files(csv_file):
+            cached = _session_cache.get(os.path.abspath(path))
+            store_file = store_path(path)
+            if (cached is not None and cached['signature'] == file_signature(path)
+                    and not is_store_current(path, store_file)):
+                write_store(cached['df'], store_file, path)
+
+# returns (column, operator, value) for every filter that is set
+# amount filters are given in dollars and compared in cents
+def filter_predicates(filters):
+    predicates = []
+    for name, value in filters.items():
+        if name in FILTER_PREDICATES and value:
+            column, operator = FILTER_PREDICATES[name]
+            predicates.append((column, operator, round(value * 100) if column == 'Amount' else value))
+    return predicates
+
+# builds one arrow mask for all predicates so rows can be dropped before they reach pandas
+def arrow_mask(table, predicates):
+    mask = None
+    for column, operator, value in predicates:
+        if operator == 'in':
+            condition = pc.is_in(table[column], value_set=pa.array(list(value), type=pa.string()))
+        else:
+            if column == 'Date':
+                value = pa.scalar(value, type=table.schema.field('Date').type)
+            compare = pc.greater_equal if operator == '>=' else pc.less_equal
+            condition = compare(table[column], value)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+# returns the memo predicates and the rest, memo predicates are answered by the memo index when it covers the rows
+def split_memo_predicates(predicates):
+    return ([predicate for predicate in predicates if predicate[1] in memo_index.MEMO_OPERATORS],
+            [predicate for predicate in predicates if predicate[1] not in memo_index.MEMO_OPERATORS])
+
+# builds one numpy mask for all predicates over an already loaded dataframe
+# memo predicates scan the memos here, query_ledger uses the memo index for them instead
+def dataframe_mask(df, predicates):
+    mask = np.ones(len(df), dtype=bool)
+    memo_predicates, predicates = split_memo_predicates(predicates)
+    if memo_predicates:
+        mask &= memo_index.scan_mask(df['Memo'], memo_predicates)
+    for column, operator, value in predicates:
+        if operator == 'in':
+            mask &= df[column].isin(value).to_numpy()
+        # a missing amount matches no range
+        elif operator == '>=':
+            mask &= (df[column] >= value).to_numpy(dtype=bool, na_value=False)
+        else:
+            mask &= (df[column] <= value).to_numpy(dtype=bool, na_value=False)
+    return mask
+
+# returns only the ledger rows matching the filters
+# the session cache is masked in place, otherwise the filters run on the memory-mapped store
+@profiling.timed('query_ledger')
+def query_ledger(csv_file, filters, columns=None, date_format=DATE_FORMAT):
+    # the ledger holds timestamps, so dates given as strings or datetime.date are converted once
+    predicates = [(column, operator, pd.Timestamp(value) if column == 'Date' else value)
+                  for column, operator, value in filter_predicates(filters)]
+    if partitions.is_partitioned(csv_file):
+        # only the partitions overlapping the date range are opened, each is queried like a single-file ledger
+        start = max((value for column, operator, value in predicates if column == 'Date' and operator == '>='),
+                    default=None)
+        end = min((value for column, operator, value in predicates if column == 'Date' and operator == '<='),
+                  default=None)
+        frames = [query_ledger(path, filters, columns, date_format)
+                  for path in partitions.partition_files(csv_file, start, end)]
+        if not frames:
+            df = empty_ledger(date_format)
+            return df[columns] if columns else df
+        return concat_ledgers(frames)
+    # memo words are looked up in the memo index, which gives a mask over the rows in file order
+    memo_predicates, predicates = split_memo_predicates(predicates)
+    cached = _session_cache.get(os.path.abspath(csv_file))
+    store_file = store_path(csv_file)
+
+    if (cached is None or cached['signature'] != file_signature(csv_file)) and is_store_current(csv_file, store_file):
+        table = feather.read_table(store_file, memory_map=True)
+        mask = arrow_mask(table, predicates) if predicates else None
+        if memo_predicates:
+            memo_mask = pa.array(memo_index.row_mask(csv_file, memo_predicates, table.num_rows, date_format))
+            mask = memo_mask if mask is None else pc.and_(mask, memo_mask)
+        if mask is not None:
+            table = table.filter(mask)
+        df = table.to_pandas()
+        return df[columns] if columns else df
+
+    df = load_ledger(csv_file, date_format=date_format)
+    if predicates or memo_predicates:
+        mask = dataframe_mask(df, predicates)
+        if memo_predicates:
+            mask &= memo_index.row_mask(csv_file, memo_predicates, len(df), date_format)
+        df = df[mask]
+    return df[columns] if columns else df
+
+if __name__ == "__main__":
+    # usage: python storage.py import <csv_file> | export <store_file> <csv_file>
+    if len(sys.argv) == 3 and sys.argv[1] == 'import':
+        df = csv_to_store(sys.argv[2])
+        print(f'Imported {len(df)} transactions into {store_path(sys.argv[2])}')
+    elif len(sys.argv) == 4 and sys.argv[1] == 'export':
+        store_to_csv(sys.argv[2], sys.argv[3])
+        print(f'Exported {sys.argv[2]} to {sys.argv[3]}')
+    else:
+        print('Usage: python storage.py import <csv_file> | export <store_file> <csv_file>')
+        sys.exit(1)